@@ -1,15 +1,28 @@
 """Flask API for fuzzy company name matching and ticker lookup."""
 
+import codecs
+import hashlib
+import json
 import logging
+import math
+import os
 import sys
-import subprocess
 import time
-import pandas as pd
-from flask import Flask,request, make_response, redirect
+from flask import Flask,request, make_response, redirect, jsonify, Response, stream_with_context, g
+import batch_match
 import data_utils
+import metrics
+import profiling
+from dataset_manager import DatasetManager
 from flasgger import Swagger
 
 APP_VERSION = "0.1.0"
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+# Time budget for /match and /match/batch when a request has no deadline_ms (0 = no limit)
+DEFAULT_DEADLINE_MS = float(os.environ.get("MATCH_DEADLINE_MS", "0"))
+# How long caches may reuse a GET /api/match answer before revalidating it with its ETag
+API_MATCH_MAX_AGE = int(os.environ.get("MATCH_API_MAX_AGE", "60"))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,12 +31,15 @@ logging.basicConfig(level=logging.INFO)
 #loads all companies from ticker dataset-nasdaq and nyse stock exchange
 try:
     TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
-    tickers_df = data_utils.load_public_companies(TICKERS_DATA_PATH)
-    tickers_df = data_utils.add_preprocessed_column(tickers_df)
+    dataset = DatasetManager(TICKERS_DATA_PATH)
+    dataset.load()
 except Exception as err:
     logging.critical("Failed to load data at startup: %s", err)
     sys.exit(1)
 
+# Opt-in profiling of single requests and sampled traffic (see profiling.py)
+request_profiler = profiling.RequestProfiler()
+
 app = Flask(__name__)
 swagger = Swagger(app, template={
     "info": {
@@ -33,6 +49,82 @@ swagger = Swagger(app, template={
     }
 })
 
+@app.before_request
+def start_profiling():
+    kind = request_profiler.wants(request.headers.get("X-Profile") or request.args.get("profile"))
+    if kind is not None:
+        profiler = request_profiler.start()
+        if profiler is not None:
+            g.profile = (profiler, kind)
+
+@app.before_request
+def pick_up_dataset_changes():
+    g.request_start = time.perf_counter()
+    # another worker may have refreshed the CSV; rebuild off the request path if so
+    dataset.reload_if_changed()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unmatched"
+    metrics.REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    start = g.get("request_start")
+    if start is not None:
+        metrics.REQUEST_SECONDS.observe(endpoint, value=time.perf_counter() - start)
+    # share this worker's numbers with the one that serves the next /metrics scrape
+    metrics.REGISTRY.flush()
+    return response
+
+@app.after_request
+def attach_profile(response):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        report = request_profiler.finish(*profile)
+        if report is not None:
+            stages, path = report
+            total = time.perf_counter() - g.request_start
+            response.headers["Server-Timing"] = profiling.server_timing(stages, total)
+            response.headers["X-Profile-File"] = path
+            logging.info("Profiled %s %s: %s", request.method, request.path, path)
+    return response
+
+@app.teardown_request
+def stop_profiling(exc):
+    # a request that raised never reached attach_profile; the profiler still has to stop
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_profiler.finish(*profile)
+
+def request_deadline(values):
+    """
+    time.monotonic() deadline from a deadline_ms argument (or MATCH_DEADLINE_MS), or None.
+
+    Raises ValueError when deadline_ms is not a positive number.
+    """
+    value = values.get("deadline_ms")
+    if value is None:
+        budget_ms = DEFAULT_DEADLINE_MS
+        if budget_ms <= 0:
+            return None
+    else:
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            budget_ms = math.nan
+        if not budget_ms > 0:
+            raise ValueError("deadline_ms must be a positive number of milliseconds.")
+    return time.monotonic() + budget_ms / 1000
+
+def match_etag(name, version):
+    """
+    Strong ETag for GET /api/match.
+
+    The body echoes the name as given, so the name is hashed as is, together with
+    the dataset version, which changes whenever a refresh changes the data, and the
+    API version, which changes with the response format.
+    """
+    key = f"{APP_VERSION}\x1f{version}\x1f{name}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
 @app.route("/")
 def root():
     return redirect("/apidocs")
@@ -47,64 +139,8 @@ def home_form():
     </form>
     '''
 
-@app.route("/match", methods=["POST"])
-def match_api():
-    """
-    Company Matcher Endpoint
-    ---
-    consumes:
-      - application/x-www-form-urlencoded
-    parameters:
-      - name: name
-        in: formData
-        type: string
-        required: true
-        description: The company name to match
-    responses:
-      200:
-        description: Returns the best match and ticker info
-    """
-    result = None
-    error_message = None
-    try:
-        name = request.form.get("name")
-        if not name:
-            error_message = "No company name provided."
-        else:
-            try:
-                start = time.time()
-                (
-                    match_name,
-                    predicted_ticker,
-                    all_possible_tickers,
-                    score,
-                    ticker_score,
-                    message,
-                    top_matches,
-                ) = data_utils.best_match(name, tickers_df)
-                end = time.time()
-                api_latency = end - start
-                logging.info(
-                    "API Latency for '%s': %.4f seconds", name, api_latency
-                )
-                result = {
-                    "input_name": name,
-                    "matched_name": match_name,
-                    "predicted_ticker": predicted_ticker,
-                    "all_possible_tickers": all_possible_tickers,
-                    "match_score": score,
-                    "ticker_score": ticker_score,
-                    "message": message,
-                    "top_matches": top_matches,
-                }
-            except Exception as err:
-                logging.error("Error during matching: %s", err)
-                error_message = (
-                    "An error occurred during matching. Please try again."
-                )
-    except Exception as err:
-        logging.error("Unexpected error in home route: %s", err)
-        error_message = "An unexpected error occurred. Please try again."
+def render_match_page(result, error_message):
+    """HTML page for /match showing result, or error_message when matching failed."""
     result_html = ""
     if error_message:
         result_html = (
@@ -183,24 +219,376 @@ def match_api():
             </body>
         </html>
     """
+    return html
+
+@app.route("/match", methods=["POST"])
+def match_api():
+    """
+    Company Matcher Endpoint
+    ---
+    consumes:
+      - application/x-www-form-urlencoded
+    parameters:
+      - name: name
+        in: formData
+        type: string
+        required: true
+        description: The company name to match
+      - name: deadline_ms
+        in: query
+        type: number
+        required: false
+        description: Time budget in milliseconds; when it runs out the best match found so far is returned and marked partial
+    responses:
+      200:
+        description: Returns the best match and ticker info (X-Match-Partial is set when the time budget ran out)
+    """
+    result = None
+    error_message = None
+    partial = False
+    try:
+        name = request.form.get("name")
+        if not name:
+            error_message = "No company name provided."
+        else:
+            try:
+                deadline = request_deadline(request.values)
+            except ValueError as err:
+                deadline = None
+                error_message = str(err)
+        if name and not error_message:
+            try:
+                start = time.time()
+                if deadline is not None:
+                    match, complete = dataset.index.match_within(name, deadline)
+                    partial = not complete
+                else:
+                    match = data_utils.best_match(name, dataset.index)
+                end = time.time()
+                api_latency = end - start
+                logging.info(
+                    "API Latency for '%s': %.4f seconds", name, api_latency
+                )
+                result = data_utils.format_match_result(name, match)
+            except Exception as err:
+                logging.error("Error during matching: %s", err)
+                error_message = (
+                    "An error occurred during matching. Please try again."
+                )
+    except Exception as err:
+        logging.error("Unexpected error in home route: %s", err)
+        error_message = "An unexpected error occurred. Please try again."
+    render_start = time.perf_counter()
+    html = render_match_page(result, error_message)
     response = make_response(html)
+    metrics.STAGE_SECONDS.observe("render", value=time.perf_counter() - render_start)
+    response.headers["X-API-Version"] = APP_VERSION
+    if partial:
+        response.headers["X-Match-Partial"] = "true"
+    return response
+
+@app.route("/api/match", methods=["GET"])
+def api_match():
+    """
+    Cacheable Company Matcher Endpoint
+    ---
+    parameters:
+      - name: name
+        in: query
+        type: string
+        required: true
+        description: The company name to match
+      - name: deadline_ms
+        in: query
+        type: number
+        required: false
+        description: Time budget in milliseconds; the result then has a "partial" flag and partial results are not cacheable
+    responses:
+      200:
+        description: Compact JSON match result with a strong ETag and Cache-Control
+      304:
+        description: If-None-Match still matches; the cached result is current
+      400:
+        description: No name given, or deadline_ms is not a positive number
+    """
+    name = request.args.get("name")
+    error = None if name else "No company name provided."
+    if error is None:
+        try:
+            deadline = request_deadline(request.args)
+        except ValueError as err:
+            error = str(err)
+    if error is not None:
+        response = jsonify({"error": error})
+        response.status_code = 400
+        response.headers["X-API-Version"] = APP_VERSION
+        return response
+
+    index = dataset.index
+    etag = match_etag(name, index.version)
+    # only complete results are ever given an ETag, so a match is current whatever the budget
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        if deadline is None:
+            match, complete = data_utils.best_match(name, index), True
+        else:
+            match, complete = index.match_within(name, deadline)
+        result = data_utils.format_match_result(name, match)
+        if deadline is not None:
+            result["partial"] = not complete
+        response = Response(json.dumps(result, separators=(",", ":")), mimetype="application/json")
+        if not complete:
+            response.cache_control.no_store = True
+            response.headers["X-API-Version"] = APP_VERSION
+            return response
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MATCH_MAX_AGE
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/match/batch", methods=["POST"])
+def match_batch_api():
+    """
+    Batch Company Matcher Endpoint
+    ---
+    consumes:
+      - application/json
+    parameters:
+      - name: names
+        in: body
+        required: true
+        description: JSON array of company names (or an object with a "names" array)
+        schema:
+          type: array
+          items:
+            type: string
+      - name: deadline_ms
+        in: query
+        type: number
+        required: false
+        description: Time budget in milliseconds for the whole batch; each result then has a "partial" flag
+    responses:
+      200:
+        description: JSON array of match results, in input order
+      400:
+        description: Body is not a JSON array of names, or deadline_ms is not a positive number
+      413:
+        description: More names than the configured maximum batch size
+    """
+    names = request.get_json(silent=True)
+    if isinstance(names, dict):
+        names = names.get("names")
+    try:
+        deadline = request_deadline(request.args)
+        deadline_error = None
+    except ValueError as err:
+        deadline_error = str(err)
+    if not isinstance(names, list):
+        response = jsonify({"error": "Expected a JSON array of company names."})
+        response.status_code = 400
+    elif deadline_error:
+        response = jsonify({"error": deadline_error})
+        response.status_code = 400
+    elif len(names) > batch_match.MAX_BATCH_SIZE:
+        response = jsonify({
+            "error": f"Batch too large: {len(names)} names, maximum is {batch_match.MAX_BATCH_SIZE}."
+        })
+        response.status_code = 413
+    else:
+        start = time.time()
+        # profiled batches run in this process, where the profiler can see them
+        workers = 1 if "profile" in g else None
+        results = batch_match.match_batch(names, dataset.index, workers=workers, deadline=deadline)
+        logging.info(
+            "Batch latency for %d names: %.4f seconds", len(names), time.time() - start
+        )
+        render_start = time.perf_counter()
+        response = jsonify(results)
+        metrics.STAGE_SECONDS.observe("render", value=time.perf_counter() - render_start)
     response.headers["X-API-Version"] = APP_VERSION
     return response
 
-@app.route("/update_tickers", methods=["GET"])
+@app.route("/tickers/lookup", methods=["POST"])
+def ticker_lookup_api():
+    """
+    Bulk Ticker Lookup Endpoint
+    ---
+    consumes:
+      - application/json
+    parameters:
+      - name: tickers
+        in: body
+        required: true
+        description: JSON array of ticker symbols (or an object with a "tickers" array); "brk-b" finds BRK.B
+        schema:
+          type: array
+          items:
+            type: string
+    responses:
+      200:
+        description: JSON array of {input, ticker, company_name} in input order, nulls for unknown symbols
+      400:
+        description: Body is not a JSON array of tickers
+      413:
+        description: More tickers than the configured maximum batch size
+    """
+    symbols = request.get_json(silent=True)
+    if isinstance(symbols, dict):
+        symbols = symbols.get("tickers")
+    if not isinstance(symbols, list):
+        response = jsonify({"error": "Expected a JSON array of ticker symbols."})
+        response.status_code = 400
+    elif len(symbols) > batch_match.MAX_BATCH_SIZE:
+        response = jsonify({
+            "error": f"Too many tickers: {len(symbols)}, maximum is {batch_match.MAX_BATCH_SIZE}."
+        })
+        response.status_code = 413
+    else:
+        results = dataset.index.lookup_tickers(symbols)
+        response = jsonify([
+            {"input": symbol, "ticker": ticker, "company_name": title}
+            for symbol, (ticker, title) in zip(symbols, results)
+        ])
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/suggest", methods=["GET"])
+def suggest_api():
+    """
+    Company Name and Ticker Suggestions
+    ---
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: What has been typed so far (a name or ticker prefix)
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maximum number of suggestions (default 10, at most SUGGEST_MAX_LIMIT)
+    responses:
+      200:
+        description: JSON array of {ticker, company_name}, best first
+    """
+    limit = min(request.args.get("limit", SUGGEST_DEFAULT_LIMIT, type=int), SUGGEST_MAX_LIMIT)
+    suggestions = dataset.index.suggest(request.args.get("q", ""), limit)
+    response = jsonify([{"ticker": ticker, "company_name": title} for ticker, title in suggestions])
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/match/stream", methods=["POST"])
+def match_stream_api():
+    """
+    Streaming Company Matcher Endpoint
+    ---
+    consumes:
+      - application/x-ndjson
+      - text/csv
+      - multipart/form-data
+    parameters:
+      - name: file
+        in: formData
+        type: file
+        required: false
+        description: NDJSON or CSV upload (the raw request body is used when omitted)
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        required: false
+        description: Input format (default from the file name or content type)
+      - name: output
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        required: false
+        description: Output format (default is the input format)
+    responses:
+      200:
+        description: One match result per input line, streamed as it is produced
+    """
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    input_format = request.args.get("format") or batch_match.detect_format(
+        upload.filename if upload else None, request.content_type
+    )
+    output_format = request.args.get("output") or input_format
+    if input_format not in batch_match.READERS or output_format not in batch_match.WRITERS:
+        response = jsonify({"error": "Formats must be ndjson or csv."})
+        response.status_code = 400
+        response.headers["X-API-Version"] = APP_VERSION
+        return response
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    body = batch_match.match_lines(lines, dataset.index, input_format, output_format)
+    response = Response(
+        stream_with_context(body), mimetype=batch_match.MIMETYPES[output_format]
+    )
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    Match Result Cache Statistics
+    ---
+    responses:
+      200:
+        description: Hit, miss and eviction counters for the match result cache
+    """
+    response = jsonify(dict(data_utils.RESULT_CACHE.stats(), dataset_version=dataset.index.version))
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/status", methods=["GET"])
+def status():
+    """
+    Dataset Status
+    ---
+    responses:
+      200:
+        description: Loaded dataset version, row count, build time and refresh state
+    """
+    response = jsonify(dataset.status())
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus Metrics
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Stage latency histograms, request counts, cache and dataset stats in Prometheus text format, summed over all workers sharing METRICS_DIR
+    """
+    index = dataset.index
+    body = metrics.REGISTRY.render(gauges=[
+        ("match_dataset_rows", "Rows in the loaded ticker dataset.", len(index)),
+        ("match_dataset_build_seconds", "Time taken to load the current dataset.", dataset.build_seconds or 0.0),
+    ])
+    response = Response(body, mimetype="text/plain; version=0.0.4")
+    response.headers["X-API-Version"] = APP_VERSION
+    return response
+
+@app.route("/update_tickers", methods=["GET", "POST"])
 def update_tickers():
     """
     Update Tickers Dataset
     ---
     responses:
       200:
-        description: Tickers updated successfully or error message
+        description: Refresh started in the background (or already running)
     """
-    try:
-        subprocess.run(["python3", "update_tickers.py"], check=True)
-        message = "Tickers updated successfully."
-    except subprocess.CalledProcessError as err:
-        message = f"Error updating tickers: {err}"
+    if dataset.refresh():
+        message = "Ticker update started in the background. Matching keeps using the current dataset until the new one is ready."
+    else:
+        message = "A ticker update is already running."
     html = f"""
         <html>
             <head>
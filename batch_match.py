@@ -0,0 +1,286 @@
+"""Bulk and streaming company matching spread across a pool of worker processes."""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import data_utils
+
+# Configurable through the environment so deployments can size batches to their boxes
+MAX_BATCH_SIZE = int(os.environ.get("MATCH_MAX_BATCH_SIZE", "10000"))
+# Every server worker (WEB_CONCURRENCY, gunicorn's worker count) gets its own pool, so by default they split the cores
+SERVER_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+BATCH_WORKERS = int(os.environ.get("MATCH_BATCH_WORKERS", str(max(1, (os.cpu_count() or 1) // SERVER_WORKERS))))
+# Forked pool workers would inherit locks (result cache, metrics) held by other request threads
+# at fork time, still locked with no thread left to release them, so start them fresh instead
+BATCH_START_METHOD = os.environ.get("MATCH_BATCH_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+BATCH_CHUNK_SIZE = int(os.environ.get("MATCH_BATCH_CHUNK_SIZE", "250"))
+# Chunks in flight per worker when streaming; bounds how far the reader runs ahead of the writer
+STREAM_READ_AHEAD = int(os.environ.get("MATCH_STREAM_READ_AHEAD", "2"))
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+RESULT_COLUMNS = [
+    "input_name",
+    "matched_name",
+    "predicted_ticker",
+    "all_possible_tickers",
+    "match_score",
+    "ticker_score",
+    "message",
+]
+
+_executor = None
+_executor_index = None
+_worker_index = None
+
+
+def _init_worker(match_index):
+    """Keep the MatchIndex handed over when the worker process starts."""
+    global _worker_index
+    _worker_index = match_index
+
+
+def match_chunk(names, match_index=None, deadline=None):
+    """
+    Match a list of names and return the API result dicts in the same order.
+
+    With a deadline (a time.monotonic() value) each dict also has a "partial" flag,
+    set when the deadline passed before the name's candidates were all scored.
+    """
+    match_index = match_index if match_index is not None else _worker_index
+    complete = [True] * len(names)
+    try:
+        if deadline is None:
+            matches = match_index.match_many(names)
+        else:
+            matches, complete = match_index.match_many_within(names, deadline)
+    except Exception as e:
+        logging.error(f"Error matching batch chunk, retrying name by name: {e}")
+        matches = [data_utils.best_match(name, match_index) for name in names]
+    results = [data_utils.format_match_result(name, match) for name, match in zip(names, matches)]
+    if deadline is not None:
+        for result, done in zip(results, complete):
+            result["partial"] = not done
+    return results
+
+
+def get_executor(match_index, workers=None):
+    """Process pool whose workers hold match_index; rebuilt when a different index is passed."""
+    global _executor, _executor_index
+    if _executor is None or _executor_index is not match_index:
+        # the old pool is not shut down here: streams still using it finish on it,
+        # and it shuts itself down once nothing references it
+        context = multiprocessing.get_context(BATCH_START_METHOD)
+        if BATCH_START_METHOD == "forkserver":
+            # workers fork from a server that has already imported the matching code
+            context.set_forkserver_preload(["data_utils"])
+        # the index reaches each worker pickled, through the __getstate__ hooks of its parts
+        _executor = ProcessPoolExecutor(
+            max_workers=workers or BATCH_WORKERS,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(match_index,),
+        )
+        _executor_index = match_index
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the worker pool, if one is running."""
+    global _executor, _executor_index
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = None
+    _executor_index = None
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def match_batch(names, match_index, workers=None, chunk_size=None, deadline=None):
+    """
+    Match a list of names across worker processes, keeping results in input order.
+
+    deadline (a time.monotonic() value) bounds the whole batch; see match_chunk.
+    """
+    workers = workers or BATCH_WORKERS
+    chunks = chunked(list(names), chunk_size or BATCH_CHUNK_SIZE)
+    # Small batches are cheaper to run inline than to ship to another process
+    if workers <= 1 or len(chunks) <= 1:
+        return [result for chunk in chunks for result in match_chunk(chunk, match_index, deadline)]
+    executor = get_executor(match_index, workers)
+    results = []
+    # the monotonic clock is system-wide, so worker processes can compare against the same deadline
+    for chunk_results in executor.map(match_chunk, chunks, repeat(None), repeat(deadline)):
+        results.extend(chunk_results)
+    return results
+
+
+def iter_chunks(iterable, size):
+    """Lazily split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _match_records(records, match_index=None):
+    names = [record.get("input_name") for record in records]
+    return list(zip(records, match_chunk(names, match_index)))
+
+
+def stream_match(records, match_index, workers=None, chunk_size=None, read_ahead=None):
+    """
+    Yield (record, result) pairs for an iterable of records, in input order.
+
+    Records are dicts with an input_name key. At most read_ahead chunks per worker
+    are pulled from the input before their results have been yielded, so memory stays
+    flat no matter how long the input is.
+    """
+    workers = workers or BATCH_WORKERS
+    chunks = iter_chunks(records, chunk_size or BATCH_CHUNK_SIZE)
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _match_records(chunk, match_index)
+        return
+    executor = get_executor(match_index, workers)
+    max_pending = workers * (read_ahead or STREAM_READ_AHEAD)
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(_match_records, chunk))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def read_ndjson(lines):
+    """Records from NDJSON lines: a JSON string, an object with input_name/name, or plain text."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            value = line
+        if isinstance(value, dict):
+            record = dict(value)
+            record.setdefault("input_name", record.get("name"))
+        else:
+            record = {"input_name": value}
+        yield record
+
+
+def read_csv(lines):
+    """Records from CSV lines; the name comes from input_name, then name, then the first column."""
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames:
+        return
+    if "input_name" in reader.fieldnames:
+        column = "input_name"
+    elif "name" in reader.fieldnames:
+        column = "name"
+    else:
+        column = reader.fieldnames[0]
+    for row in reader:
+        row["input_name"] = row.get(column)
+        yield row
+
+
+def write_ndjson(pairs):
+    """One JSON result per line."""
+    for _, result in pairs:
+        yield json.dumps(result) + "\n"
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def write_csv(pairs):
+    """CSV lines holding the input columns followed by the result columns."""
+    extra_columns = None
+    for record, result in pairs:
+        if extra_columns is None:
+            extra_columns = [c for c in record if c not in RESULT_COLUMNS]
+            yield _csv_line(extra_columns + RESULT_COLUMNS)
+        row = [record.get(c) for c in extra_columns]
+        for column in RESULT_COLUMNS:
+            value = result[column]
+            row.append(";".join(value) if isinstance(value, list) else value)
+        yield _csv_line(row)
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv}
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def detect_format(filename=None, content_type=None):
+    """Guess csv or ndjson from a filename or content type, defaulting to ndjson."""
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+
+def match_lines(lines, match_index, input_format, output_format=None, **options):
+    """Generator of output lines for an iterable of input lines."""
+    records = READERS[input_format](lines)
+    pairs = stream_match(records, match_index, **options)
+    return WRITERS[output_format or input_format](pairs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match a file of company names line by line.")
+    parser.add_argument("input", help="CSV (input_name column) or NDJSON file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout")
+    parser.add_argument("--format", choices=sorted(READERS), help="input format (default: from extension)")
+    parser.add_argument("--output-format", choices=sorted(WRITERS), help="output format (default: input format)")
+    parser.add_argument("--tickers", default=TICKERS_DATA_PATH, help="tickers dataset CSV")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    input_format = args.format or detect_format(args.input)
+    match_index = data_utils.load_match_index(args.tickers)
+    infile = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8-sig")
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    count = 0
+    try:
+        for line in match_lines(
+            infile, match_index, input_format, args.output_format,
+            workers=args.workers, chunk_size=args.chunk_size,
+        ):
+            outfile.write(line)
+            count += 1
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+        shutdown_executor()
+    logging.info(f"Wrote {count} lines to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
@@ -0,0 +1,78 @@
+"""Micro-benchmark: legacy preprocess_name vs the normalize module, per call and per column."""
+
+import csv
+import logging
+import re
+import timeit
+
+from normalize import normalize_many, normalize_name, preprocess_name
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+QUERIES_PATH = "supplemental_data/half.csv"
+
+
+def legacy_preprocess_name(name):
+    """preprocess_name as it was before the normalize module, kept for comparison."""
+    if not isinstance(name, str):
+        return name
+    name = name.lower()
+    name = re.sub(r"[^a-z0-9 ]", "", name)
+    suffixes = [
+        " inc", " corporation", " corp", " ltd", " llc", " co", " - common stock",
+        "- common stock", " common stock", " incorporated", " plc", " group", " holdings",
+        " company", " companies", " lp", " ag", " sa", " nv", " spa", " srl", " limited",
+        " the", " and", " of", " dba", " llp", " pty", " s p a", " s a",
+        " inc", " inc", " inc", " inc",
+    ]
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+    name = re.sub(r"\s+", " ", name)
+    return name.strip()
+
+
+def read_column(path, column):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [row[column] for row in csv.DictReader(f)]
+
+
+def best_of(func, repeat=5, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def main():
+    titles = read_column(TICKERS_DATA_PATH, "title")
+    queries = read_column(QUERIES_PATH, "input_name")
+
+    legacy_titles = [legacy_preprocess_name(t) for t in titles]
+    assert normalize_many(titles) == legacy_titles, "normalize_many output differs from legacy"
+    assert [preprocess_name(q) for q in queries] == [legacy_preprocess_name(q) for q in queries]
+
+    per_call = [
+        ("legacy preprocess_name", lambda: [legacy_preprocess_name(q) for q in queries]),
+        ("normalize_name (no memo)", lambda: [normalize_name(q) for q in queries]),
+        ("preprocess_name (memoized)", lambda: [preprocess_name(q) for q in queries]),
+    ]
+    logging.info(f"Per call, {len(queries)} queries from {QUERIES_PATH}:")
+    baseline = None
+    for label, func in per_call:
+        seconds = best_of(func) / len(queries)
+        baseline = baseline or seconds
+        logging.info(f"  {label:<28} {seconds * 1e6:8.2f} us/call  {baseline / seconds:5.1f}x")
+
+    per_column = [
+        ("legacy per-row", lambda: [legacy_preprocess_name(t) for t in titles]),
+        ("normalize_many", lambda: normalize_many(titles)),
+    ]
+    logging.info(f"Per column, {len(titles)} titles from {TICKERS_DATA_PATH}:")
+    baseline = None
+    for label, func in per_column:
+        seconds = best_of(func)
+        baseline = baseline or seconds
+        logging.info(f"  {label:<28} {seconds * 1e3:8.2f} ms/column  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,51 @@
-import pandas as pd
-from fuzzywuzzy import process
+import copy
+import csv
+import hashlib
+import heapq
 import logging
+import os
+import sys
+import tempfile
+import time
+from bisect import insort
+from itertools import chain
 
+from fuzzywuzzy import fuzz, utils
 
-def preprocess_name(name):
-    """Remove common company suffixes, punctuation, and non-alphanumeric chars for better matching."""
-    if not isinstance(name, str):
-        return name
-    import re
-
-    name = name.lower()
-    name = re.sub(r"[^a-z0-9 ]", "", name)  # Remove all non-alphanumeric except space
-    suffixes = [
-        " inc",
-        " corporation",
-        " corp",
-        " ltd",
-        " llc",
-        " co",
-        " - common stock",
-        "- common stock",
-        " common stock",
-        " incorporated",
-        " plc",
-        " group",
-        " holdings",
-        " company",
-        " companies",
-        " lp",
-        " ag",
-        " sa",
-        " nv",
-        " spa",
-        " srl",
-        " limited",
-        " the",
-        " and",
-        " of",
-        " dba",
-        " llp",
-        " pty",
-        " s p a",
-        " s a",
-        " inc",
-        " inc",
-        " inc",
-        " inc",
-    ]
-    #gets rid of common company suffixes and normalizes whitespace
-    for suffix in suffixes:
-        if name.endswith(suffix):
-            name = name[: -len(suffix)]
-    name = re.sub(r"\s+", " ", name)  # Normalize whitespace
-    return name.strip()
+import metrics
+from match_cache import MISSING, LRUCache
+from ngram_index import NgramIndex
+from normalize import normalize_many, normalize_prefix, preprocess_name
+from prefix_index import PrefixIndex
+from score_bounds import TextProfile, could_reach, score_bound
+
+
+def atomic_write(path, write, mode="w"):
+    """Call write(file) on a temp file in path's directory, then rename it over path."""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode, **({} if "b" in mode else {"newline": ""})) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+# pandas is only imported by the DataFrame helpers used in offline tooling; serving runs on
+# MatchIndex's plain lists, so workers never load it.
+
+# read_csv's default missing-value markers, so read_tickers_csv sees gaps exactly as pandas does
+PANDAS_NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
 
 
 def load_public_companies(csv_path):
     """Load public companies from a CSV file."""
+    import pandas as pd
     try:
         return pd.read_csv(csv_path)
     except Exception as e:
@@ -65,65 +54,638 @@ def load_public_companies(csv_path):
 
 
 def add_preprocessed_column(tickers_df):
-    tickers_df['preprocessed_title'] = tickers_df['title'].apply(preprocess_name)
+    import pandas as pd
+    # whole-column normalization instead of a per-row .apply(preprocess_name)
+    tickers_df['preprocessed_title'] = pd.Series(
+        normalize_many(tickers_df['title']), index=tickers_df.index, dtype=object
+    )
     return tickers_df
 
 
-def best_match(name, tickers_df):
+def read_tickers_csv(csv_path):
+    """
+    Title and ticker columns of the tickers CSV, read without pandas.
+
+    Missing titles come back as NaN and missing tickers as None, the same values
+    load_public_companies followed by MatchIndex.from_dataframe produce.
+    """
     try:
-        if not isinstance(name, str):
-            logging.warning(f"Input name is not a string: {name}")
-            return None, None, [], 0, None, "Company is not in public company list", []
-
-        # 1. Try exact match against raw company names
-        exact_matches = tickers_df[tickers_df['title'] == name]
-        if not exact_matches.empty:
-            matched_row = exact_matches.iloc[0]
-            ticker = matched_row["ticker"] if "ticker" in matched_row and pd.notnull(matched_row["ticker"]) else None
-            return matched_row['title'], ticker, [ticker] if ticker else [], 100, 100, None, [{
-                "company_name": matched_row['title'],
-                "ticker": ticker,
-                "score": 100
-            }]
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            return parse_tickers_csv(f)
+    except Exception as e:
+        logging.error(f"Error loading public companies from {csv_path}: {e}")
+        raise
 
-        # 2. Preprocess input and match against preprocessed company names
-        name_processed = preprocess_name(name)
-        companies_list = tickers_df["preprocessed_title"].tolist()
-        matches = process.extract(name_processed, companies_list, limit=10)
-        strong_matches = [(company, score) for company, score in matches if score >= 90]
+
+def parse_tickers_csv(lines):
+    """Title and ticker columns from the lines of a tickers CSV, as read_tickers_csv returns them."""
+    titles = []
+    tickers = []
+    for row in csv.DictReader(lines):
+        title = row.get("title")
+        ticker = row.get("ticker")
+        titles.append(float("nan") if title is None or title in PANDAS_NA_VALUES else title)
+        tickers.append(None if ticker is None or ticker in PANDAS_NA_VALUES else ticker)
+    return titles, tickers
+
+
+def load_match_index(csv_path):
+    """Load the tickers CSV and build a MatchIndex from it."""
+    titles, tickers = read_tickers_csv(csv_path)
+    return MatchIndex(titles, tickers, normalize_many(titles))
+
+
+NOT_PUBLIC_MESSAGE = "Company is not in public company list"
+PARTIAL_MESSAGE = "Time budget ran out before every candidate was scored; a better match may exist"
+TICKER_MAX_LENGTH = 12
+# "BRK-B", "BRK/B" and "BRK B" are all written BRK.B in the dataset
+_TICKER_SEPARATORS = str.maketrans("-/ ", "...")
+
+# Shared by every MatchIndex; entries are keyed on the dataset version so a refresh invalidates them
+RESULT_CACHE = LRUCache(int(os.environ.get("MATCH_CACHE_SIZE", "10000")))
+# Skip candidates whose WRatio upper bound is below the cutoff (set to 0 to score every candidate)
+SCORE_PRUNING = os.environ.get("MATCH_SCORE_PRUNING", "1") != "0"
+# candidates ranked between clock reads while ordering them for a deadline-bound match
+_DEADLINE_CHECK_INTERVAL = 64
+
+
+def _collect_cache_metrics():
+    stats = RESULT_CACHE.stats()
+    for event in ("hits", "misses", "evictions"):
+        metrics.CACHE_EVENTS.set(event, value=stats[event])
+    metrics.CACHE_ENTRIES.set(value=stats["size"])
+
+
+metrics.REGISTRY.add_collector(_collect_cache_metrics)
+
+
+def ticker_key(symbol):
+    """Canonical form of a ticker symbol as typed ("$brk-b" -> "BRK.B")."""
+    return symbol.strip().lstrip("$").translate(_TICKER_SEPARATORS).upper()
+
+
+def _extract_scorer(query, choice):
+    """WRatio on strings that were already run through fuzzywuzzy's full_process."""
+    return fuzz.WRatio(query, choice, full_process=False)
+
+
+def _build_multimap(values):
+    """Map each string value to the list of row positions holding it, in row order."""
+    multimap = {}
+    for i, value in enumerate(values):
+        if isinstance(value, str):
+            multimap.setdefault(value, []).append(i)
+    return multimap
+
+
+def _multimap_discard(multimap, value, row):
+    """Remove row from value's list in a _build_multimap, copying the list rather than changing it."""
+    if isinstance(value, str):
+        rows = [r for r in multimap[value] if r != row]
+        if rows:
+            multimap[value] = rows
+        else:
+            del multimap[value]
+
+
+def _multimap_add(multimap, value, row):
+    """Add row to value's list in a _build_multimap, keeping it in row order, without changing the old list."""
+    if isinstance(value, str):
+        rows = list(multimap.get(value, ()))
+        insort(rows, row)
+        multimap[value] = rows
+
+
+def _interned(values):
+    """List of values with every string interned, so equal strings across columns share memory."""
+    intern = sys.intern
+    return [intern(v) if type(v) is str else v for v in values]
+
+
+def dataset_version(titles, tickers):
+    """Short content hash of the ticker dataset, used to key caches."""
+    digest = hashlib.sha1()
+    for title, ticker in zip(titles, tickers):
+        digest.update(f"{title}\x1f{ticker}\x1e".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class MatchIndex:
+    """Candidate strings and row metadata built once from add_preprocessed_column output."""
+
+    def __init__(self, titles, tickers, preprocessed_titles, blocking=True,
+                 min_shared_ngrams=1, min_ngram_overlap=0.5, full_scan_on_miss=False,
+                 cache=RESULT_CACHE, version=None, choices=None, ngram_index=None,
+                 prune=SCORE_PRUNING):
+        self.titles = _interned(titles)
+        self.tickers = _interned(tickers)
+        self.preprocessed_titles = _interned(preprocessed_titles)
+        self.version = version or dataset_version(self.titles, self.tickers)
+        self.cache = cache
+        # process.extract would run full_process on every choice for every query, so do it once here
+        if choices is None:
+            choices = [utils.full_process(t, force_ascii=True) for t in self.preprocessed_titles]
+        # most choices equal their preprocessed title; interning stores those strings once
+        self.choices = _interned(choices)
+        # Rows whose names normalize to the same string (repeated listings, test issues) are
+        # scored once: fuzzy matching runs over the distinct names and expands back to rows
+        self.name_rows = list(_build_multimap(self.choices).values())
+        self.names = [self.choices[rows[0]] for rows in self.name_rows]
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        # rows emptied by apply_delta; they stay as placeholders until the next full load
+        self.removed_rows = 0
+        # per-name lengths/tokens/histograms for the score bounds, built on first use
+        self.prune = prune
+        self._profiles = [None] * len(self.names)
+        # Hash indexes so row resolution never has to scan the whole dataset
+        self.rows_by_title = _build_multimap(self.titles)
+        self.row_by_ticker = {}
+        for i, ticker in enumerate(self.tickers):
+            if ticker is not None:
+                self.row_by_ticker.setdefault(ticker, i)
+        # Trigram blocking: only candidates sharing enough n-grams with the query get scored.
+        # min_shared_ngrams/min_ngram_overlap are the recall guard; full_scan_on_miss rescans
+        # the whole list when the shortlist has no strong match.
+        # (snapshots pass in a prebuilt ngram_index)
+        if not blocking:
+            ngram_index = None
+        elif ngram_index is None:
+            ngram_index = NgramIndex(self.names)
+        self.ngram_index = ngram_index
+        # sorted keys for search-as-you-type
+        self.title_prefixes = PrefixIndex(self.preprocessed_titles)
+        self.ticker_prefixes = PrefixIndex(self.tickers)
+        self.min_shared_ngrams = min_shared_ngrams
+        self.min_ngram_overlap = min_ngram_overlap
+        self.full_scan_on_miss = full_scan_on_miss
+
+    @classmethod
+    def from_dataframe(cls, tickers_df):
+        """Build the index from a DataFrame that already has a preprocessed_title column."""
+        import pandas as pd
+        tickers = tickers_df["ticker"] if "ticker" in tickers_df else [None] * len(tickers_df)
+        return cls(
+            tickers_df["title"].tolist(),
+            [t if pd.notnull(t) else None for t in tickers],
+            tickers_df["preprocessed_title"].tolist(),
+        )
+
+    def __len__(self):
+        return len(self.titles) - self.removed_rows
+
+    def prepare(self):
+        """Build the lookup tables the first query would otherwise build, e.g. before going live."""
+        if self.ngram_index is not None:
+            self.ngram_index.prepare(self.min_shared_ngrams, self.min_ngram_overlap)
+        return self
+
+    def apply_delta(self, delta):
+        """
+        New MatchIndex with a dataset_delta's removed, renamed and added tickers applied.
+
+        Only the changed rows are normalized and indexed; everything else is shared
+        with this index, which stays valid for the requests still using it. Removed
+        rows are left empty and added rows are appended, so the rows keep the order
+        of the updated CSV and every match, ties included, is the one a full load
+        of that CSV would give. Raises ValueError if the delta does not fit.
+        """
+        index = copy.copy(self)
+        for name in ("titles", "tickers", "preprocessed_titles", "choices", "names", "name_rows", "_profiles"):
+            setattr(index, name, list(getattr(self, name)))
+        for name in ("rows_by_title", "row_by_ticker", "name_ids"):
+            setattr(index, name, dict(getattr(self, name)))
+        index.version = delta.get("version")
+
+        def row_of(ticker, title):
+            if ticker is not None:
+                row = self.row_by_ticker.get(ticker)
+            else:
+                # rows without a ticker are identified by their title
+                row = next((r for r in self.rows_by_title.get(title, ()) if self.tickers[r] is None), None)
+            if row is None:
+                raise ValueError(f"Delta refers to {ticker or title!r}, which is not in the dataset")
+            return row
+
+        cleared = [row_of(ticker, title) for ticker, title in delta["removed"]]
+        renamed = [(row_of(ticker, None), title) for ticker, title in delta["renamed"]]
+        start = len(self.titles)
+        added = [(start + i, ticker, title) for i, (ticker, title) in enumerate(delta["added"])]
+        if any(ticker in self.row_by_ticker for _, ticker, _ in added):
+            raise ValueError("Delta adds a ticker that is already in the dataset")
+
+        removed_prefixes = []
+        removed_names = {}
+        for row in cleared + [row for row, _ in renamed]:
+            removed_prefixes.append((self.preprocessed_titles[row], row))
+            _multimap_discard(index.rows_by_title, self.titles[row], row)
+            choice = self.choices[row]
+            name_id = index.name_ids.get(choice)
+            if name_id is not None:
+                rows = index.name_rows[name_id] = [r for r in index.name_rows[name_id] if r != row]
+                if not rows:
+                    # names are never renumbered; an unused one just keeps an empty row list
+                    del index.name_ids[choice]
+                    removed_names[name_id] = choice
+        for row in cleared:
+            index.row_by_ticker.pop(self.tickers[row], None)
+            index.titles[row] = float("nan")
+            index.tickers[row] = index.preprocessed_titles[row] = index.choices[row] = None
+        index.removed_rows += len(cleared)
+
+        changed = [(row, self.tickers[row], title) for row, title in renamed] + added
+        titles = [float("nan") if title is None else title for _, _, title in changed]
+        preprocessed = normalize_many(titles)
+        added_names = {}
+        for (row, ticker, _), title, preprocessed_title in zip(changed, titles, preprocessed):
+            choice = sys.intern(utils.full_process(preprocessed_title, force_ascii=True))
+            values = (title, ticker, preprocessed_title, choice)
+            values = [sys.intern(v) if type(v) is str else v for v in values]
+            if row == len(index.titles):
+                index.titles.append(None)
+                index.tickers.append(None)
+                index.preprocessed_titles.append(None)
+                index.choices.append(None)
+                if ticker is not None:
+                    index.row_by_ticker[ticker] = row
+            index.titles[row], index.tickers[row], index.preprocessed_titles[row], index.choices[row] = values
+            _multimap_add(index.rows_by_title, values[0], row)
+            name_id = index.name_ids.get(choice)
+            if name_id is None:
+                name_id = index.name_ids[choice] = len(index.names)
+                index.names.append(choice)
+                index.name_rows.append([row])
+                index._profiles.append(None)
+                added_names[name_id] = choice
+            else:
+                index.name_rows[name_id] = sorted(index.name_rows[name_id] + [row])
+
+        if self.ngram_index is not None:
+            index.ngram_index = self.ngram_index.updated(removed_names, added_names)
+        index.title_prefixes = self.title_prefixes.updated(
+            removed_prefixes, [(index.preprocessed_titles[row], row) for row, _, _ in changed]
+        )
+        index.ticker_prefixes = self.ticker_prefixes.updated(
+            [(self.tickers[row], row) for row in cleared], [(ticker, row) for row, ticker, _ in added]
+        )
+        if index.version is None:
+            # every loaded row has a string choice; only emptied rows hold None
+            live = [row for row, choice in enumerate(index.choices) if choice is not None]
+            index.version = dataset_version([index.titles[row] for row in live], [index.tickers[row] for row in live])
+        return index
+
+    def _row_for_title(self, title):
+        """Return the first row whose raw title equals title, or None."""
+        rows = self.rows_by_title.get(title)
+        return rows[0] if rows else None
+
+    def row_for_ticker(self, ticker):
+        """Return the row holding ticker, or None."""
+        return self.row_by_ticker.get(ticker)
+
+    def _profile(self, name_id):
+        profile = self._profiles[name_id]
+        if profile is None:
+            profile = self._profiles[name_id] = TextProfile(self.names[name_id])
+        return profile
+
+    def _score(self, query, candidates, limit, cutoff=None):
+        """
+        Top `limit` (row, score) pairs for candidate name ids, same order as process.extract.
+
+        Each distinct name is scored once and every row holding it gets that score, so
+        the ranking, including ties, is the one a scan over all rows would give. With
+        pruning on, names that provably score below cutoff are never run through
+        WRatio. Matches at or above the cutoff come out exactly as without pruning;
+        only which weaker scores fill the rest of the list can differ.
+        """
+        names = self.names
+        if self.prune and cutoff:
+            query_profile = TextProfile(query)
+            considered = len(candidates)
+            candidates = [i for i in candidates if could_reach(query_profile, self._profile(i), cutoff)]
+            metrics.CANDIDATES.inc("pruned", amount=considered - len(candidates))
+            metrics.CANDIDATES.inc("scored", amount=len(candidates))
+        name_rows = self.name_rows
+        scored = [
+            (row, score)
+            for i in candidates
+            for score in (_extract_scorer(query, names[i]),)
+            for row in name_rows[i]
+        ]
+        # nlargest keeps the earliest of tied entries, so feed rows in dataset order
+        scored.sort()
+        return heapq.nlargest(limit, scored, key=lambda x: x[1])
+
+    def _score_within(self, query, candidates, limit, cutoff, deadline):
+        """
+        Anytime version of _score: (matches, complete), scoring until deadline.
+
+        Candidates are scored in descending order of their WRatio upper bound, so
+        the likeliest matches are found first, and scoring stops as soon as no
+        remaining candidate can reach the current top `limit`; up to that point the
+        matches are the ones _score would return. If deadline (a time.monotonic()
+        value) passes first, the best matches scored so far come back with complete
+        False.
+        """
+        if limit <= 0:
+            return [], True
+        query_profile = TextProfile(query)
+        prune = self.prune and cutoff
+        bounded = []
+        checked = 0
+        for checked, i in enumerate(candidates, 1):
+            # ranking a full scan takes a while too, so it also watches the clock
+            if not checked % _DEADLINE_CHECK_INTERVAL and time.monotonic() >= deadline:
+                metrics.CANDIDATES.inc("unscored", amount=len(candidates) - checked + 1 + len(bounded))
+                metrics.CANDIDATES.inc("pruned", amount=checked - 1 - len(bounded))
+                return [], False
+            profile = self._profile(i)
+            if prune and not could_reach(query_profile, profile, cutoff):
+                continue
+            bounded.append((-score_bound(query_profile, profile), i))
+        pruned = checked - len(bounded)
+        # stable sort by bound only, so equal bounds are scored in dataset order
+        bounded.sort(key=lambda item: item[0])
+        names = self.names
+        name_rows = self.name_rows
+        scored = []
+        top = []  # the `limit` best row scores so far, as a min-heap
+        complete = True
+        stop = len(bounded)
+        for position, (neg_bound, i) in enumerate(bounded):
+            if len(top) == limit and -neg_bound < top[0]:
+                # a candidate that could tie top[0] may sit on an earlier row and win the tie,
+                # so only ones whose bound is below it are skipped
+                stop = position
+                pruned += len(bounded) - stop
+                break
+            if time.monotonic() >= deadline:
+                stop = position
+                metrics.CANDIDATES.inc("unscored", amount=len(bounded) - stop)
+                complete = False
+                break
+            score = _extract_scorer(query, names[i])
+            for row in name_rows[i]:
+                scored.append((row, score))
+                if len(top) < limit:
+                    heapq.heappush(top, score)
+                elif score > top[0]:
+                    heapq.heapreplace(top, score)
+        metrics.CANDIDATES.inc("pruned", amount=pruned)
+        metrics.CANDIDATES.inc("scored", amount=stop)
+        scored.sort()
+        return heapq.nlargest(limit, scored, key=lambda x: x[1]), complete
+
+    def _extract(self, name_processed, limit, cutoff, deadline=None):
+        """
+        Score a preprocessed query against the shortlisted (or all) candidates.
+
+        Returns (matches, complete); complete is False only when deadline cut the shortlist or scoring short.
+        """
+        query = utils.full_process(name_processed, force_ascii=True)
+        if not query:
+            # every comparison against an empty query scores 0
+            return [], True
+
+        def score(candidates):
+            if deadline is None:
+                return self._score(query, candidates, limit, cutoff), True
+            return self._score_within(query, candidates, limit, cutoff, deadline)
+
+        all_names = range(len(self.names))
+        candidates = None
+        if self.ngram_index is not None:
+            candidates, complete = self.ngram_index.shortlist_within(
+                query, deadline, self.min_shared_ngrams, self.min_ngram_overlap
+            )
+            if not complete:
+                return [], False
+        if candidates is None:
+            return score(all_names)
+        matches, complete = score(candidates)
+        if complete and self.full_scan_on_miss and not any(s >= cutoff for _, s in matches):
+            rescanned, complete = score(all_names)
+            # a rescan cut short is only worth keeping if it found what the shortlist missed
+            if complete or any(s >= cutoff for _, s in rescanned):
+                matches = rescanned
+        return matches, complete
+
+    def row_for_symbol(self, symbol):
+        """Row for a ticker symbol in any common spelling ("aapl", "BRK-B"), or None."""
+        return self.row_by_ticker.get(ticker_key(symbol))
+
+    def _ticker_input_row(self, name):
+        """Row when the whole input is a ticker written in capitals ("AAPL", "BRK.B"), or None.
+
+        Lower- and mixed-case input is always treated as a name, so "Ford" or "visa"
+        are never taken for the FORD or V tickers.
+        """
+        symbol = name.strip()
+        if not symbol or len(symbol) > TICKER_MAX_LENGTH or symbol != symbol.upper():
+            return None
+        return self.row_for_symbol(symbol)
+
+    def lookup_tickers(self, symbols):
+        """(ticker, title) for each symbol, or (None, None) when it is not in the dataset."""
+        results = []
+        for symbol in symbols:
+            row = self.row_for_symbol(symbol) if isinstance(symbol, str) else None
+            results.append((None, None) if row is None else (self.tickers[row], self.titles[row]))
+        return results
+
+    def suggest(self, text, limit=10):
+        """
+        Up to limit (ticker, title) pairs for partially typed text.
+
+        An exact ticker comes first, then titles starting with the text, then tickers
+        starting with it; each row is listed once.
+        """
+        if not isinstance(text, str) or limit <= 0:
+            return []
+        symbol = ticker_key(text)
+        exact = self.row_for_ticker(symbol)
+        rows = chain(
+            () if exact is None else (exact,),
+            self.title_prefixes.iter_prefix(normalize_prefix(text)),
+            self.ticker_prefixes.iter_prefix(symbol),
+        )
+        suggestions = []
+        seen = set()
+        for row in rows:
+            if row in seen:
+                continue
+            seen.add(row)
+            suggestions.append((self.tickers[row], self.titles[row]))
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+    def _exact(self, name):
+        """Result for an exact company title or ticker symbol, without any fuzzy scoring."""
+        row = self._row_for_title(name)
+        if row is None:
+            row = self._ticker_input_row(name)
+        if row is None:
+            return None
+        ticker = self.tickers[row]
+        return self.titles[row], ticker, [ticker] if ticker else [], 100, 100, None, [{
+            "company_name": self.titles[row],
+            "ticker": ticker,
+            "score": 100
+        }]
+
+    def _resolve(self, name, matches, cutoff):
+        """Turn scored candidates into the best_match result tuple."""
+        strong_matches = [(row, score) for row, score in matches if score >= cutoff]
 
         if not strong_matches:
-            logging.info(f"No strong matches (score >= 90) found for {name}")
-            return None, None, [], 0, None, "Company is not in public company list", []
-
-        # Get the best match (highest score)
-        best_match_name, best_score = max(strong_matches, key=lambda x: x[1])
-        matched_row = tickers_df[tickers_df["preprocessed_title"] == best_match_name]
-        if matched_row.empty:
-            logging.warning(f"Matched name {best_match_name} not found in public company list")
-            return best_match_name, None, [], best_score, None, "Company is not in public company list", []
-        matched_row = matched_row.iloc[0]
-        ticker = matched_row["ticker"] if "ticker" in matched_row and pd.notnull(matched_row["ticker"]) else None
-
-        # Get all possible tickers from strong matches
+            logging.info(f"No strong matches (score >= {cutoff}) found for {name}")
+            return None, None, [], 0, None, NOT_PUBLIC_MESSAGE, []
+
+        # Get the best match (highest score, earliest row on ties)
+        row, best_score = max(strong_matches, key=lambda x: x[1])
+        ticker = self.tickers[row]
+
+        # Every matched row is its own security, so each brings its own ticker
         all_possible_tickers = []
         top_matches = []
-        for company, score in strong_matches:
-            row = tickers_df[tickers_df["preprocessed_title"] == company]
-            if not row.empty:
-                t = row.iloc[0]["ticker"]
-                if pd.notnull(t):
-                    all_possible_tickers.append(t)
-                top_matches.append({
-                    "company_name": row.iloc[0]["title"],
-                    "ticker": t if pd.notnull(t) else None,
-                    "score": score
-                })
+        for match_row, score in strong_matches:
+            t = self.tickers[match_row]
+            if t is not None:
+                all_possible_tickers.append(t)
+            top_matches.append({
+                "company_name": self.titles[match_row],
+                "ticker": t,
+                "score": score
+            })
         # Remove duplicates
         all_possible_tickers = list(dict.fromkeys(all_possible_tickers))
 
         ticker_score = 100 if ticker else None
-        return matched_row['title'], ticker, all_possible_tickers, best_score, ticker_score, None, top_matches
+        return self.titles[row], ticker, all_possible_tickers, best_score, ticker_score, None, top_matches
+
+    def _fuzzy_match(self, name, name_processed, limit, cutoff, deadline=None):
+        """Fuzzy stage of match as (result, complete), served from the result cache when possible.
+
+        Cached tuples are shared between callers and must be treated as read-only.
+        Results cut short by the deadline are never cached.
+        """
+        key = (self.version, name_processed, limit, cutoff)
+        if self.cache is not None:
+            result = self.cache.get(key)
+            if result is not MISSING:
+                return result, True
+        if deadline is not None and time.monotonic() >= deadline:
+            # out of time before shortlisting even started: answer now rather than start on it
+            return (None, None, [], 0, None, PARTIAL_MESSAGE, []), False
+        start = time.perf_counter()
+        matches, complete = self._extract(name_processed, limit, cutoff, deadline)
+        scored = time.perf_counter()
+        result = self._resolve(name, matches, cutoff)
+        metrics.STAGE_SECONDS.observe("fuzzy", value=scored - start)
+        metrics.STAGE_SECONDS.observe("resolve", value=time.perf_counter() - scored)
+        if not complete:
+            result = result[:5] + (PARTIAL_MESSAGE,) + result[6:]
+        elif self.cache is not None:
+            self.cache.put(key, result)
+        return result, complete
+
+    def match(self, name, limit=10, cutoff=90):
+        """Match a single company name; returns the same tuple as best_match."""
+        return self.match_within(name, None, limit, cutoff)[0]
+
+    def match_within(self, name, deadline, limit=10, cutoff=90):
+        """
+        Match a single company name as (result, complete), giving up at deadline.
+
+        deadline is a time.monotonic() value, or None for no limit. When it passes
+        during fuzzy scoring, result holds the best matches found so far, its message
+        says so, and complete is False.
+        """
+        if not isinstance(name, str):
+            logging.warning(f"Input name is not a string: {name}")
+            return (None, None, [], 0, None, NOT_PUBLIC_MESSAGE, []), True
+
+        # 1. Try exact match against raw company names, then ticker symbols
+        start = time.perf_counter()
+        exact = self._exact(name)
+        metrics.STAGE_SECONDS.observe("exact", value=time.perf_counter() - start)
+        if exact is not None:
+            return exact, True
+
+        # 2. Preprocess input and match against preprocessed company names
+        start = time.perf_counter()
+        name_processed = preprocess_name(name)
+        metrics.STAGE_SECONDS.observe("normalize", value=time.perf_counter() - start)
+        return self._fuzzy_match(name, name_processed, limit, cutoff, deadline)
+
+    def match_many(self, names, limit=10, cutoff=90):
+        """Match a batch of names, scoring each distinct preprocessed name only once."""
+        return self.match_many_within(names, None, limit, cutoff)[0]
+
+    def match_many_within(self, names, deadline, limit=10, cutoff=90):
+        """
+        match_many with one deadline for the whole batch: (results, complete flags).
+
+        Exact and cached matches are always returned; names still waiting for fuzzy
+        scoring when the deadline passes get whatever was found before it, flagged
+        incomplete, and the ones not yet started are answered without scoring.
+        """
+        results = [None] * len(names)
+        complete = [True] * len(names)
+        pending = {}
+        for pos, name in enumerate(names):
+            if not isinstance(name, str):
+                results[pos] = self.match(name, limit, cutoff)
+                continue
+            start = time.perf_counter()
+            exact = self._exact(name)
+            looked_up = time.perf_counter()
+            metrics.STAGE_SECONDS.observe("exact", value=looked_up - start)
+            if exact is not None:
+                results[pos] = exact
+                continue
+            name_processed = preprocess_name(name)
+            metrics.STAGE_SECONDS.observe("normalize", value=time.perf_counter() - looked_up)
+            pending.setdefault(name_processed, []).append(pos)
+
+        for name_processed, positions in pending.items():
+            result, done = self._fuzzy_match(names[positions[0]], name_processed, limit, cutoff, deadline)
+            for pos in positions:
+                results[pos] = result
+                complete[pos] = done
+        return results, complete
+
+
+def format_match_result(name, match):
+    """Turn a best_match result tuple into the dict returned by the API."""
+    (
+        match_name,
+        predicted_ticker,
+        all_possible_tickers,
+        score,
+        ticker_score,
+        message,
+        top_matches,
+    ) = match
+    return {
+        "input_name": name,
+        "matched_name": match_name,
+        "predicted_ticker": predicted_ticker,
+        "all_possible_tickers": all_possible_tickers,
+        "match_score": score,
+        "ticker_score": ticker_score,
+        "message": message,
+        "top_matches": top_matches,
+    }
+
+
+def best_match(name, match_index):
+    """Match a company name against a MatchIndex (or a preprocessed tickers DataFrame)."""
+    try:
+        if not isinstance(match_index, MatchIndex):
+            match_index = MatchIndex.from_dataframe(match_index)
+        return match_index.match(name)
     except Exception as e:
         logging.error(f"Error in best_match for name '{name}': {e}")
-        return None, None, [], 0, None, "Company is not in public company list", []
\ No newline at end of file
+        return None, None, [], 0, None, NOT_PUBLIC_MESSAGE, []
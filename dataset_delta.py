@@ -0,0 +1,117 @@
+"""
+Ticker-level changes between two versions of the tickers CSV.
+
+update_tickers.py writes one next to the CSV every time it rewrites it, and the
+server applies it to the live MatchIndex instead of rebuilding from scratch. A
+delta only fits the CSV it was computed against (base_sha1) and the CSV written
+with it (sha1); anything else falls back to a full load.
+"""
+
+import json
+import logging
+import os
+
+from data_utils import atomic_write
+
+FORMAT_VERSION = 1
+
+
+def delta_path(csv_path):
+    """Deltas live next to the CSV they update."""
+    return os.path.splitext(csv_path)[0] + ".delta.json"
+
+
+def _same(a, b):
+    # missing titles are NaN, which never equals itself
+    return a == b or (not isinstance(a, str) and not isinstance(b, str))
+
+
+def _title(title):
+    return title if isinstance(title, str) else None
+
+
+def row_key(title, ticker):
+    """
+    What identifies a row from one CSV version to the next: its ticker.
+
+    The odd listing without a ticker (pandas reads the symbol "NA" as missing) is
+    identified by its title instead.
+    """
+    return ticker if isinstance(ticker, str) else (None, _title(title))
+
+
+def _row_keys(titles, tickers):
+    """Row position by row_key, or None if some row cannot be told apart from the others."""
+    rows = {}
+    for i, key in enumerate(map(row_key, titles, tickers)):
+        if key == (None, None) or key in rows:
+            return None
+        rows[key] = i
+    return rows
+
+
+def compute_delta(old_titles, old_tickers, new_titles, new_tickers):
+    """
+    Removed, renamed and added rows as [ticker, title] pairs, or None.
+
+    Returns None when the change cannot be expressed as a delta: a row has neither
+    ticker nor title, a ticker is listed twice, or the new rows are not the surviving
+    old rows in their old order followed by the added ones (update_tickers writes
+    them that way).
+    """
+    old_rows = _row_keys(old_titles, old_tickers)
+    new_rows = _row_keys(new_titles, new_tickers)
+    if old_rows is None or new_rows is None:
+        return None
+    renamed = []
+    added = []
+    last_row = -1
+    for key, (title, ticker) in zip(new_rows, zip(new_titles, new_tickers)):
+        row = old_rows.get(key)
+        if row is None:
+            added.append([ticker, _title(title)])
+            continue
+        if added or row < last_row:
+            return None
+        last_row = row
+        if not _same(old_titles[row], title):
+            renamed.append([ticker, _title(title)])
+    removed = [
+        [ticker, _title(title)]
+        for key, ticker, title in zip(old_rows, old_tickers, old_titles)
+        if key not in new_rows
+    ]
+    return {"removed": removed, "renamed": renamed, "added": added}
+
+
+def write_delta(csv_path, delta, base_sha1, sha1, version):
+    """Save delta for the CSV at csv_path, which changed from base_sha1 to sha1."""
+    delta = dict(delta, format=FORMAT_VERSION, base_sha1=base_sha1, sha1=sha1, version=version)
+    atomic_write(delta_path(csv_path), lambda f: json.dump(delta, f))
+    logging.info(
+        f"Wrote delta for {csv_path}: {len(delta['added'])} added, "
+        f"{len(delta['removed'])} removed, {len(delta['renamed'])} renamed"
+    )
+
+
+def read_delta(csv_path):
+    """The delta saved next to csv_path, or None if there is none or it cannot be read."""
+    try:
+        with open(delta_path(csv_path)) as f:
+            delta = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        logging.warning(f"Ignoring unreadable delta for {csv_path}: {err}")
+        return None
+    if delta.get("format") != FORMAT_VERSION:
+        return None
+    return delta
+
+
+def remove_delta(csv_path):
+    """Delete the delta next to csv_path so nobody applies it to a CSV it does not describe."""
+    try:
+        os.remove(delta_path(csv_path))
+    except FileNotFoundError:
+        pass
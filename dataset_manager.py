@@ -0,0 +1,153 @@
+"""Owns the live MatchIndex and swaps in rebuilt ones without blocking requests."""
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import dataset_delta
+import snapshot
+
+UPDATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "update_tickers.py")
+# How often a worker checks whether another process has rewritten the tickers CSV
+RELOAD_CHECK_INTERVAL = float(os.environ.get("DATASET_RELOAD_CHECK_SECONDS", "5"))
+# Patch the live index with the updater's delta instead of rebuilding it (0 always rebuilds)
+APPLY_DELTAS = os.environ.get("DATASET_APPLY_DELTAS", "1") != "0"
+# Rebuild in full once rows emptied by deltas make up more than this share of the index
+MAX_REMOVED_FRACTION = float(os.environ.get("DATASET_DELTA_MAX_REMOVED_FRACTION", "0.1"))
+
+
+class DatasetManager:
+    """
+    Holds the MatchIndex currently used for matching.
+
+    Refreshes download and build a new index on a background thread, then replace
+    self.index in a single assignment. Requests that grabbed the old index keep
+    using it until they finish, so nobody ever sees a half-built index.
+    """
+
+    def __init__(self, csv_path, loader=snapshot.load_match_index, apply_deltas=APPLY_DELTAS):
+        self.csv_path = csv_path
+        self.loader = loader
+        self.apply_deltas = apply_deltas
+        self.index = None
+        self.loaded_at = None
+        self.build_seconds = None
+        self.source_mtime = None
+        self.source_sha1 = None
+        self.last_refresh = None
+        self.last_error = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self._last_reload_check = 0.0
+
+    def load(self):
+        """Build an index from the CSV and make it the live one."""
+        start = time.time()
+        mtime = os.path.getmtime(self.csv_path)
+        sha1 = snapshot.file_sha1(self.csv_path)
+        index = self.loader(self.csv_path).prepare()
+        self._swap(index, start, mtime, sha1, "full")
+        return index
+
+    def apply_delta(self):
+        """
+        Patch the live index with the delta next to the CSV; returns False if it does not fit.
+
+        The delta has to lead from the CSV the live index was built from to the one on
+        disk now. Otherwise, or when too many rows have been removed since the last
+        full load, the caller should load() instead.
+        """
+        delta = dataset_delta.read_delta(self.csv_path)
+        if delta is None or self.index is None or delta["base_sha1"] != self.source_sha1:
+            return False
+        start = time.time()
+        mtime = os.path.getmtime(self.csv_path)
+        sha1 = snapshot.file_sha1(self.csv_path)
+        if delta["sha1"] != sha1:
+            return False
+        try:
+            index = self.index.apply_delta(delta)
+        except (KeyError, ValueError) as err:
+            logging.warning("Delta for %s does not apply, reloading in full: %s", self.csv_path, err)
+            return False
+        if index.removed_rows > MAX_REMOVED_FRACTION * len(index.titles):
+            logging.info("Removed rows have built up, reloading %s in full to compact them", self.csv_path)
+            return False
+        self._swap(index, start, mtime, sha1, "delta")
+        logging.info(
+            "Applied delta: %d added, %d removed, %d renamed",
+            len(delta["added"]), len(delta["removed"]), len(delta["renamed"]),
+        )
+        return True
+
+    def _swap(self, index, start, mtime, sha1, kind):
+        build_seconds = time.time() - start
+        # single reference assignment: in-flight requests keep the index they already hold
+        self.index = index
+        self.loaded_at = time.time()
+        self.build_seconds = build_seconds
+        self.source_mtime = mtime
+        self.source_sha1 = sha1
+        self.last_refresh = kind
+        logging.info(
+            "Loaded dataset version %s (%d rows, %s) in %.2f seconds",
+            index.version, len(index), kind, build_seconds,
+        )
+
+    @property
+    def refreshing(self):
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+
+    def refresh(self, download=True):
+        """Start a background refresh; returns False if one is already running."""
+        with self._refresh_lock:
+            if self.refreshing:
+                return False
+            self._refresh_thread = threading.Thread(
+                target=self._refresh, args=(download,), name="dataset-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+            return True
+
+    def _refresh(self, download):
+        try:
+            if download:
+                subprocess.run([sys.executable, UPDATE_SCRIPT], check=True)
+            if not (self.apply_deltas and self.apply_delta()):
+                self.load()
+            self.last_error = None
+        except Exception as err:
+            logging.error("Dataset refresh failed: %s", err)
+            self.last_error = str(err)
+
+    def reload_if_changed(self):
+        """Rebuild in the background when the CSV on disk is newer than the loaded one.
+
+        Lets every gunicorn worker pick up a refresh that ran in a different worker.
+        """
+        now = time.time()
+        if now - self._last_reload_check < RELOAD_CHECK_INTERVAL:
+            return
+        self._last_reload_check = now
+        try:
+            mtime = os.path.getmtime(self.csv_path)
+        except OSError:
+            return
+        if self.source_mtime is not None and mtime > self.source_mtime:
+            self.refresh(download=False)
+
+    def status(self):
+        """Version, size and build time of the loaded dataset."""
+        index = self.index
+        return {
+            "dataset_version": index.version if index is not None else None,
+            "rows": len(index) if index is not None else 0,
+            "build_seconds": self.build_seconds,
+            "last_refresh": self.last_refresh,
+            "loaded_at": self.loaded_at,
+            "refreshing": self.refreshing,
+            "last_error": self.last_error,
+        }
@@ -1,138 +1,231 @@
+"""
+Evaluate accuracy and speed of the matcher on the supplemental test sets.
+
+Every input name is matched exactly once, spread across a pool of worker processes.
+Per dataset it reports name/ticker accuracy, recall, specificity, throughput and
+p50/p95/p99 latency, and writes them to a JSON file that can be diffed between
+commits. With --baseline, a drop in accuracy or a slowdown beyond --max-slowdown
+exits non-zero.
+"""
+
+import argparse
+import json
 import logging
-logging.basicConfig(level=logging.INFO, format='%(message)s')
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
-from data_utils import best_match, load_public_companies, add_preprocessed_column
-
-# Load your dataset (only public companies)
-tickers_df = load_public_companies("supplemental_data/company_tickers.csv")
-tickers_df = add_preprocessed_column(tickers_df)
-
-# Load your test cases
-try:
-    test_df = pd.read_csv('supplemental_data/half.csv')
-    logging.info(f"Loaded test cases shape: {test_df.shape}")
-    logging.info(f"Test cases columns: {test_df.columns}")
-except Exception as e:
-    logging.error(f"Error loading test cases: {e}")
-    raise
-
-correct_name = 0
-correct_ticker = 0
-correct_ticker_public = 0
-public_total = 0
-total = len(test_df)
-#iterates through each row in the test dataframe and calls best match function
-for idx, row in test_df.iterrows():
-    input_name = row["input_name"]
-    expected_name = row["expected_name"]
-    expected_ticker = row["expected_ticker"]
-
-    try:
-        (
-            matched_name,
-            predicted_ticker,
-            all_possible_tickers,
-            score,
-            ticker_score,
-            message,
-            top_matches,
-        ) = best_match(input_name, tickers_df)
-    except Exception as e:
-        logging.error(f"Error in best_match for input '{input_name}': {e}")
-        continue
-
-    def normalize_name(name):
-        return name.strip().lower() if isinstance(name, str) else ""
-
-    expected_name_norm = normalize_name(expected_name)
-    top_names_norm = [normalize_name(m['company_name']) for m in top_matches]
-
-    expected_name_is_nan = pd.isna(expected_name) or expected_name == ""
-    matched_name_is_none = matched_name is None
-    expected_ticker_is_nan = pd.isna(expected_ticker) or expected_ticker == ""
-
-    # Updated logic: If matched_name is None and expected_ticker is NaN/empty, count as correct name match
-    if matched_name is None and expected_ticker_is_nan:
-        name_match = True
-    else:
-        name_match = (
-            matched_name
-            and expected_name
-            and (
-                normalize_name(matched_name) == expected_name_norm
-                or expected_name_norm in top_names_norm
+
+import perf_report
+from data_utils import best_match, load_match_index
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+DATASETS = {
+    "half": "supplemental_data/half.csv",
+    "mispell": "supplemental_data/mispell.csv",
+    "nyse_test": "supplemental_data/nyse_test.csv",
+    "nyse_exact_test": "supplemental_data/nyse_exact_test.csv",
+}
+RESULTS_JSON = "evaluation_results.json"
+RESULTS_TEXT = "evaluation_results.txt"
+EVAL_WORKERS = int(os.environ.get("EVAL_WORKERS", str(os.cpu_count() or 1)))
+EVAL_CHUNK_SIZE = int(os.environ.get("EVAL_CHUNK_SIZE", "25"))
+ACCURACY_METRICS = ("name_accuracy", "ticker_accuracy", "recall", "specificity")
+
+_worker_index = None
+
+
+def _init_worker(match_index):
+    global _worker_index
+    _worker_index = match_index
+
+
+def _timed_matches(names, match_index=None):
+    """best_match every name, returning (result, seconds) pairs in input order."""
+    match_index = match_index if match_index is not None else _worker_index
+    results = []
+    for name in names:
+        start = time.perf_counter()
+        result = best_match(name, match_index)
+        results.append((result, time.perf_counter() - start))
+    return results
+
+
+def normalize_name(name):
+    return name.strip().lower() if isinstance(name, str) else ""
+
+
+def score_dataset(test_df, results, seconds):
+    """Accuracy, throughput and latency metrics for one dataset's (result, latency) pairs."""
+    correct_name = 0
+    correct_ticker = 0
+    correct_ticker_public = 0
+    public_total = 0
+    true_negatives = 0
+    non_public_total = 0
+    total = len(test_df)
+
+    rows = zip(test_df["expected_name"], test_df["expected_ticker"])
+    for (expected_name, expected_ticker), (result, _) in zip(rows, results):
+        matched_name, predicted_ticker, all_possible_tickers, _, _, _, top_matches = result
+
+        expected_name_norm = normalize_name(expected_name)
+        top_names_norm = [normalize_name(m['company_name']) for m in top_matches]
+        expected_ticker_is_nan = pd.isna(expected_ticker) or expected_ticker == ""
+        predicted_ticker_is_none = predicted_ticker is None or all_possible_tickers == []
+
+        # If matched_name is None and expected_ticker is NaN/empty, count as correct name match
+        if matched_name is None and expected_ticker_is_nan:
+            name_match = True
+        else:
+            name_match = (
+                matched_name
+                and expected_name
+                and (
+                    normalize_name(matched_name) == expected_name_norm
+                    or expected_name_norm in top_names_norm
+                )
+            )
+        # if expected ticker is nan or empty, a ticker match means no ticker was predicted
+        if expected_ticker_is_nan and predicted_ticker_is_none:
+            ticker_match = True
+        else:
+            ticker_match = (
+                predicted_ticker
+                and expected_ticker
+                and expected_ticker in all_possible_tickers
             )
-        )
-    #if expected ticker is nan or empty, then set ticker match to true if not check if predicted ticker is in all possible tickers
-    predicted_ticker_is_none = predicted_ticker is None or all_possible_tickers == []
-    if expected_ticker_is_nan and predicted_ticker_is_none:
-        ticker_match = True
-    else:
-        ticker_match = (
-            predicted_ticker
-            and expected_ticker
-            and expected_ticker in all_possible_tickers
-        )
-
-    if name_match:
-        correct_name += 1
-    if ticker_match:
-        correct_ticker += 1
-
-    # Only count recall for public companies
-    if not expected_ticker_is_nan:
-        public_total += 1
-        if expected_ticker in all_possible_tickers:
-            correct_ticker_public += 1
-    #if name or ticker does not match, then log the error
-    #if not name_match or not ticker_match:
-        #logging.error(f"Input: {input_name}")
-        #logging.error(f"  Expected Name: {expected_name}, Got: {matched_name}")
-        #logging.error(
-        #    f"  Expected Ticker: {expected_ticker}, Got: {predicted_ticker}, All Possible: {all_possible_tickers}"
-        #)
-        #logging.error("---")
-
-#logs the results
-logging.info(f"Total test cases: {total}")
-logging.info(f"Correct company name matches: {correct_name} ({correct_name/total:.2%})")
-logging.info(f"Correct ticker matches: {correct_ticker} ({correct_ticker/total:.2%})")
-
-# Recall for public companies (fixed)
-recall = correct_ticker_public / public_total if public_total > 0 else 0
-#logging.info(f"Ticker prediction recall (public companies): {recall:.2%}")
-
-# Specificity for non-public companies
-#looks for all non-public companies and checks if the ticker is not in the all possible tickers because they are not public
-non_public_cases = test_df[test_df['expected_ticker'].isna() | (test_df['expected_ticker'] == '')]
-non_public_total = len(non_public_cases)
-true_negatives = 0
-for idx, row in non_public_cases.iterrows():
-    input_name = row["input_name"]
-    expected_ticker = row["expected_ticker"]
-    #calls best match function and returns the result
-    (
-        matched_name,
-        predicted_ticker,
-        all_possible_tickers,
-        score,
-        ticker_score,
-        message,
-        top_matches,
-    ) = best_match(input_name, tickers_df)
-    if (pd.isna(expected_ticker) or expected_ticker == "") and (predicted_ticker is None or all_possible_tickers == []):
-        true_negatives += 1
-specificity = true_negatives / non_public_total if non_public_total > 0 else 0
-#logging.info(f"Non-public company specificity (true negative rate): {specificity:.2%}")
-
-results_summary = (
-    f"Total test cases: {total}\n"
-    f"Correct company name matches: {correct_name} ({correct_name/total:.2%})\n"
-    f"Correct ticker matches: {correct_ticker} ({correct_ticker/total:.2%})\n"
-    f"Ticker prediction recall (public companies): {recall:.2%}\n"
-    f"Non-public company specificity (true negative rate): {specificity:.2%}\n"
-)
-
-with open("evaluation_results.txt", "w") as f:
-    f.write(results_summary)
+
+        if name_match:
+            correct_name += 1
+        if ticker_match:
+            correct_ticker += 1
+
+        # Recall only counts public companies, specificity only non-public ones
+        if expected_ticker_is_nan:
+            non_public_total += 1
+            if predicted_ticker_is_none:
+                true_negatives += 1
+        else:
+            public_total += 1
+            if expected_ticker in all_possible_tickers:
+                correct_ticker_public += 1
+
+    latencies = sorted(latency * 1000 for _, latency in results)
+    return {
+        "total": total,
+        "correct_name": correct_name,
+        "correct_ticker": correct_ticker,
+        "name_accuracy": correct_name / total if total else 0,
+        "ticker_accuracy": correct_ticker / total if total else 0,
+        "recall": correct_ticker_public / public_total if public_total else 0,
+        "specificity": true_negatives / non_public_total if non_public_total else 0,
+        "seconds": round(seconds, 3),
+        "names_per_second": round(total / seconds, 1) if seconds else 0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            **perf_report.latency_percentiles(latencies),
+        },
+    }
+
+
+def evaluate(datasets, match_index, workers=None, chunk_size=None):
+    """Metrics per dataset name, matching every input once across a process pool."""
+    workers = workers or EVAL_WORKERS
+    chunk_size = chunk_size or EVAL_CHUNK_SIZE
+    # Latency should measure the matcher, not repeats served from the result cache
+    match_index.cache = None
+    report = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(match_index,)) as executor:
+        # Warm every worker up so process start-up is not charged to the first dataset
+        list(executor.map(_timed_matches, [[]] * workers))
+        for name, path in datasets.items():
+            test_df = pd.read_csv(path)
+            names = test_df["input_name"].tolist()
+            chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+            start = time.perf_counter()
+            results = [pair for chunk in executor.map(_timed_matches, chunks) for pair in chunk]
+            seconds = time.perf_counter() - start
+            report[name] = score_dataset(test_df, results, seconds)
+            logging.info(format_summary(name, report[name]))
+    return report
+
+
+def format_summary(name, metrics):
+    total = metrics["total"]
+    latency = metrics["latency_ms"]
+    return (
+        f"[{name}]\n"
+        f"Total test cases: {total}\n"
+        f"Correct company name matches: {metrics['correct_name']} ({metrics['name_accuracy']:.2%})\n"
+        f"Correct ticker matches: {metrics['correct_ticker']} ({metrics['ticker_accuracy']:.2%})\n"
+        f"Ticker prediction recall (public companies): {metrics['recall']:.2%}\n"
+        f"Non-public company specificity (true negative rate): {metrics['specificity']:.2%}\n"
+        f"Throughput: {metrics['names_per_second']} names/sec\n"
+        f"Latency p50/p95/p99: {latency['p50']}/{latency['p95']}/{latency['p99']} ms\n"
+    )
+
+
+def find_regressions(report, baseline, max_slowdown):
+    """Human-readable reasons report is worse than baseline (empty when it is not)."""
+    return perf_report.find_regressions(
+        report["datasets"], baseline.get("datasets", {}), max_slowdown,
+        "names_per_second", "names/sec", ACCURACY_METRICS,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("datasets", nargs="*",
+                        help=f"datasets to evaluate, any of {', '.join(DATASETS)} (default: all)")
+    parser.add_argument("--tickers", default=TICKERS_DATA_PATH, help="ticker dataset CSV")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=None, help="names sent to a worker at a time")
+    parser.add_argument("-o", "--output", default=RESULTS_JSON, help="JSON results file")
+    parser.add_argument("--baseline", help="earlier JSON results to check for regressions")
+    parser.add_argument("--max-slowdown", type=float, default=0.25,
+                        help="allowed fractional throughput/latency regression against the baseline")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.datasets if name not in DATASETS]
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+
+    baseline = None
+    if args.baseline:
+        # read up front: the baseline may be the same file the results are written to
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    datasets = {name: DATASETS[name] for name in (args.datasets or DATASETS)}
+    match_index = load_match_index(args.tickers)
+    workers = args.workers or EVAL_WORKERS
+    report = {
+        "dataset_version": match_index.version,
+        "workers": workers,
+        "datasets": evaluate(datasets, match_index, workers, args.chunk_size),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    with open(RESULTS_TEXT, "w") as f:
+        f.write("\n".join(format_summary(name, metrics) for name, metrics in report["datasets"].items()))
+    logging.info(f"Wrote results to {args.output} and {RESULTS_TEXT}")
+
+    if baseline is not None:
+        problems = find_regressions(report, baseline, args.max_slowdown)
+        for problem in problems:
+            logging.error(f"Regression: {problem}")
+        if problems:
+            return 1
+        logging.info(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
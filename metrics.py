@@ -0,0 +1,231 @@
+"""
+In-process counters and latency histograms, exported in Prometheus text format.
+
+Every process records into its own registry with a lock and a bisect per
+observation. With METRICS_DIR set, each process periodically dumps its registry to
+METRICS_DIR/metrics-<pid>.json and /metrics sums all the dumps, so the numbers
+cover every gunicorn worker and not just the one that served the scrape. Point
+METRICS_DIR at a directory that is emptied when the service starts (e.g. a tmpfs).
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "1"))
+# seconds; matching stages range from microseconds (exact lookup) to seconds (full scans)
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, *labels, value):
+        """Mirror a total kept elsewhere (e.g. the cache's own hit counter)."""
+        with self._lock:
+            self.values[labels] = value
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+
+class Gauge(Counter):
+    """Point-in-time value; the per-process values are summed across processes."""
+
+    type = "gauge"
+
+
+class Histogram:
+    """Bucketed distribution (non-cumulative counts plus sum), one per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(labels)
+            if state is None:
+                # one count per bucket, one for +Inf, then the running sum
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bucket] += 1
+            state[-1] += value
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), list(state)] for labels, state in self.values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+
+class Registry:
+    """The metrics of one process, plus merging and rendering of several processes' dumps."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._last_flush = 0.0
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collect):
+        """Register a callable run before every dump, to copy values kept elsewhere into metrics."""
+        self.collectors.append(collect)
+
+    def dump(self):
+        """JSON-serializable snapshot of every metric's values."""
+        for collect in self.collectors:
+            collect()
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def flush(self, directory=None, force=False):
+        """Write this process's dump to directory, at most every METRICS_FLUSH_SECONDS unless forced."""
+        directory = directory or METRICS_DIR
+        now = time.time()
+        if not directory or (not force and now - self._last_flush < METRICS_FLUSH_SECONDS):
+            return
+        self._last_flush = now
+        # imported here because data_utils itself records into this module
+        from data_utils import atomic_write
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        try:
+            atomic_write(path, lambda f: json.dump(self.dump(), f))
+        except OSError as err:
+            logging.warning(f"Could not write metrics to {path}: {err}")
+
+    def collect(self, directory=None):
+        """Values summed over every process that flushed to directory (or just this one)."""
+        directory = directory or METRICS_DIR
+        if not directory:
+            return self.dump()
+        self.flush(directory, force=True)
+        totals = {name: {} for name in self.metrics}
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    dump = json.load(f)
+            except (OSError, ValueError) as err:
+                logging.warning(f"Skipping unreadable metrics file {path}: {err}")
+                continue
+            for name, values in dump.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in values:
+                    key = tuple(labels)
+                    totals[name][key] = metric.merge(totals[name].get(key), value)
+        return {name: [[list(k), v] for k, v in values.items()] for name, values in totals.items()}
+
+    def render(self, directory=None, gauges=()):
+        """
+        Prometheus text exposition of the collected metrics.
+
+        gauges are extra (name, help, value) triples for point-in-time values such as
+        the dataset size, which are taken from the scraped process.
+        """
+        collected = self.collect(directory)
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(collected.get(name, []), key=lambda item: item[0]):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.type != "histogram":
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric.buckets) + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+        for name, help, value in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "match_stage_seconds",
+    "Time spent in each matching stage (exact, normalize, fuzzy, resolve, render).",
+    ("stage",),
+)
+REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests handled, by endpoint, method and status.",
+    ("endpoint", "method", "status"),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, by endpoint.", ("endpoint",),
+)
+CANDIDATES = REGISTRY.counter(
+    "match_candidates_total", "Fuzzy candidates ruled out by the score bounds, scored with WRatio, or left unscored at a deadline.",
+    ("outcome",),
+)
+CACHE_EVENTS = REGISTRY.counter(
+    "match_cache_events_total", "Match result cache hits, misses and evictions.", ("event",),
+)
+CACHE_ENTRIES = REGISTRY.gauge("match_cache_entries", "Entries held in the match result caches.")
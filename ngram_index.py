@@ -0,0 +1,214 @@
+"""Character n-gram inverted index used to shortlist candidates before fuzzy scoring."""
+
+import math
+import time
+from bisect import bisect_left
+from collections import Counter
+
+NGRAM_SIZE = 3
+# a bisect step costs about this many C-level set lookups
+BISECT_COST = 10
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """Distinct character n-grams of text (empty for strings shorter than n)."""
+    if not isinstance(text, str):
+        return set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _sorted_intersection(few, many):
+    """Items of the ascending sequence few that are also in the much longer ascending sequence many."""
+    found = []
+    lo = 0
+    for i in few:
+        lo = bisect_left(many, i, lo)
+        if lo == len(many):
+            break
+        if many[lo] == i:
+            found.append(i)
+    return found
+
+
+class NgramIndex:
+    """Inverted index from character n-gram to the ids of the strings containing it."""
+
+    def __init__(self, strings, n=NGRAM_SIZE):
+        self.n = n
+        self.postings = {}
+        self.gram_counts = []
+        for i, text in enumerate(strings):
+            grams = ngrams(text, n)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+        # strings too short to have any n-gram can never be shortlisted, so always keep them
+        self.gramless_ids = [i for i, count in enumerate(self.gram_counts) if count == 0]
+        # (min_shared, min_overlap) -> postings of each string's rarest n-grams only, built on first use
+        self._prefixes = {}
+
+    @classmethod
+    def from_postings(cls, postings, gram_counts, n=NGRAM_SIZE):
+        """Rebuild an index from stored postings (gram -> id sequence) and per-string gram counts."""
+        index = cls.__new__(cls)
+        index.n = n
+        index.postings = postings
+        index.gram_counts = gram_counts
+        index.gramless_ids = [i for i, count in enumerate(gram_counts) if count == 0]
+        index._prefixes = {}
+        return index
+
+    def updated(self, removed, added):
+        """
+        Copy with the strings in removed (id -> string) dropped and those in added indexed.
+
+        Added ids must continue the existing numbering. Only the postings of the
+        affected n-grams are copied; the rest are shared with this index.
+        """
+        index = NgramIndex.__new__(NgramIndex)
+        index.n = self.n
+        postings = index.postings = dict(self.postings)
+        gram_counts = index.gram_counts = list(self.gram_counts)
+        copied = {}
+
+        def own(table, gram):
+            # copy a shared posting list the first time this update changes it
+            if gram not in copied.setdefault(id(table), set()):
+                table[gram] = list(table.get(gram, ()))
+                copied[id(table)].add(gram)
+            return table[gram]
+
+        def drop_emptied(table):
+            for gram in copied.get(id(table), ()):
+                if not table[gram]:
+                    del table[gram]
+
+        for i, text in removed.items():
+            for gram in ngrams(text, self.n):
+                own(postings, gram).remove(i)
+        index.gramless_ids = [i for i in self.gramless_ids if i not in removed]
+        added_grams = []
+        for i, text in sorted(added.items()):
+            if i != len(gram_counts):
+                raise ValueError(f"n-gram ids must be added in order, expected {len(gram_counts)} got {i}")
+            grams = ngrams(text, self.n)
+            gram_counts.append(len(grams))
+            added_grams.append((i, grams))
+            for gram in grams:
+                own(postings, gram).append(i)
+            if not grams:
+                index.gramless_ids.append(i)
+        # carry built prefix postings over rather than rebuilding them on the next query
+        index._prefixes = {}
+        for (min_shared, min_overlap), old_prefix in self._prefixes.items():
+            prefix = index._prefixes[min_shared, min_overlap] = dict(old_prefix)
+            for i, text in removed.items():
+                for gram in ngrams(text, self.n):
+                    if i in prefix.get(gram, ()):
+                        own(prefix, gram).remove(i)
+            for i, grams in added_grams:
+                for gram in index._rarest(grams, min_shared, min_overlap):
+                    own(prefix, gram).append(i)
+            drop_emptied(prefix)
+        drop_emptied(postings)
+        return index
+
+    def __getstate__(self):
+        # postings loaded from a snapshot are memoryviews, which cannot be pickled
+        state = self.__dict__.copy()
+        state["postings"] = {gram: list(ids) for gram, ids in self.postings.items()}
+        state["gram_counts"] = list(self.gram_counts)
+        return state
+
+    def _rarest(self, grams, min_shared, min_overlap):
+        """
+        The n-grams a string must share at least one of to ever be shortlisted.
+
+        A string with c n-grams needs s = max(min_shared, min_overlap * c) of them in a
+        query no larger than itself, so at most c - s can be missing: any c - s + 1 of
+        them will do, and the rarest ones have the shortest postings.
+        """
+        needed = max(min_shared, 1, math.ceil(min_overlap * len(grams)))
+        if needed > len(grams):
+            return []
+        postings = self.postings
+        return sorted(grams, key=lambda gram: (len(postings[gram]), gram))[:len(grams) - needed + 1]
+
+    def prepare(self, min_shared=1, min_overlap=0.5):
+        """Build what shortlist would otherwise build on its first call with these settings."""
+        self._prefix_postings(min_shared, min_overlap)
+
+    def _prefix_postings(self, min_shared, min_overlap):
+        prefix = self._prefixes.get((min_shared, min_overlap))
+        if prefix is None:
+            grams_by_id = [[] for _ in self.gram_counts]
+            for gram, ids in self.postings.items():
+                for i in ids:
+                    grams_by_id[i].append(gram)
+            prefix = {}
+            for i, grams in enumerate(grams_by_id):
+                for gram in self._rarest(grams, min_shared, min_overlap):
+                    prefix.setdefault(gram, []).append(i)
+            self._prefixes[min_shared, min_overlap] = prefix
+        return prefix
+
+    def shortlist(self, query, min_shared=1, min_overlap=0.5):
+        """
+        Ids of strings sharing enough n-grams with query, in ascending id order.
+
+        A string is kept when it shares at least min_shared n-grams with the query and
+        the shared count is at least min_overlap of the smaller n-gram set. Returns None
+        when the query is too short to have n-grams, meaning the caller should scan everything.
+
+        Postings are counted rarest first. Once the n-grams left could no longer take a
+        string no smaller than the query from zero to its threshold, the common ones
+        only add to the ids already seen and to the shorter strings that list them among
+        their own rarest n-grams, so common n-grams never cost a pass over their postings.
+        """
+        return self.shortlist_within(query, None, min_shared, min_overlap)[0]
+
+    def shortlist_within(self, query, deadline, min_shared=1, min_overlap=0.5):
+        """
+        shortlist as (ids, complete), giving up at deadline.
+
+        deadline is a time.monotonic() value, or None for no limit. The clock is read
+        before each n-gram's postings; once it has passed, ([], False) comes back.
+        """
+        grams = ngrams(query, self.n)
+        if not grams:
+            return None, True
+        query_count = len(grams)
+        gram_counts = self.gram_counts
+        postings = self.postings
+        threshold = max(min_shared, 1, min_overlap * query_count)
+        ordered = sorted(grams, key=lambda gram: len(postings.get(gram, ())))
+        shared = Counter()
+        for counted, gram in enumerate(ordered):
+            if query_count - counted < threshold:
+                common = ordered[counted:]
+                candidates = set(shared)
+                prefix = self._prefix_postings(min_shared, min_overlap)
+                for other in common:
+                    candidates.update(i for i in prefix.get(other, ()) if gram_counts[i] < query_count)
+                in_order = sorted(candidates)
+                for other in common:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return [], False
+                    ids = postings.get(other, ())
+                    if len(in_order) * BISECT_COST < len(ids):
+                        shared.update(_sorted_intersection(in_order, ids))
+                    else:
+                        shared.update(candidates.intersection(ids))
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return [], False
+            shared.update(postings.get(gram, ()))
+        # min() inlined: this runs once per id sharing any counted n-gram
+        ids = [
+            i for i, count in shared.items()
+            if count >= min_shared
+            and count >= min_overlap * (gram_counts[i] if gram_counts[i] < query_count else query_count)
+        ]
+        ids.extend(self.gramless_ids)
+        ids.sort()
+        return ids, True
@@ -0,0 +1,143 @@
+"""Company name normalization used for both the dataset titles and incoming queries."""
+
+import os
+import re
+from functools import lru_cache
+
+# Order matters: each suffix is tried once, in this order, against whatever is left of the
+# name, so e.g. "x group holdings" only loses " holdings". " inc" is listed five times,
+# which strips up to five trailing " inc". Entries with "-" can never match because the
+# character filter has already removed dashes; they are kept so the behaviour is unchanged.
+COMPANY_SUFFIXES = (
+    " inc",
+    " corporation",
+    " corp",
+    " ltd",
+    " llc",
+    " co",
+    " - common stock",
+    "- common stock",
+    " common stock",
+    " incorporated",
+    " plc",
+    " group",
+    " holdings",
+    " company",
+    " companies",
+    " lp",
+    " ag",
+    " sa",
+    " nv",
+    " spa",
+    " srl",
+    " limited",
+    " the",
+    " and",
+    " of",
+    " dba",
+    " llp",
+    " pty",
+    " s p a",
+    " s a",
+    " inc",
+    " inc",
+    " inc",
+    " inc",
+)
+
+# last word of each suffix -> (position, suffix) pairs in list order; a name can only end
+# with a suffix if its own last word is one of these keys
+_SUFFIXES_BY_LAST_WORD = {}
+for _position, _suffix in enumerate(COMPANY_SUFFIXES):
+    _SUFFIXES_BY_LAST_WORD.setdefault(_suffix.rsplit(" ", 1)[-1], []).append((_position, _suffix))
+
+# every ASCII byte except a-z, 0-9 and space; non-ASCII is dropped by the ascii encode
+_KEEP = set(b"abcdefghijklmnopqrstuvwxyz0123456789 ")
+_DELETE_BYTES = bytes(c for c in range(128) if c not in _KEEP)
+# same, but keeps the newline used to join a whole column into one string
+_DELETE_BYTES_KEEP_NEWLINE = _DELETE_BYTES.replace(b"\n", b"")
+
+_SPACE_RUNS = re.compile(r" {2,}")
+_LINE_EDGE_SPACES = re.compile(r" ?\n ?")
+
+NORMALIZE_CACHE_SIZE = int(os.environ.get("NORMALIZE_CACHE_SIZE", "65536"))
+
+
+def _filter_chars(name):
+    """Lowercase and keep only a-z, 0-9 and spaces (same as re.sub(r"[^a-z0-9 ]", "", name.lower()))."""
+    return name.lower().encode("ascii", "ignore").translate(None, _DELETE_BYTES).decode("ascii")
+
+
+def strip_suffixes(name):
+    """
+    Apply COMPANY_SUFFIXES to name in list order in a single pass.
+
+    Instead of calling endswith for all 34 entries, look up the suffixes sharing the
+    name's last word and jump straight to the next list position that matches.
+    """
+    position = 0
+    while True:
+        candidates = _SUFFIXES_BY_LAST_WORD.get(name[name.rfind(" ") + 1:])
+        if not candidates:
+            return name
+        for candidate, suffix in candidates:
+            if candidate >= position and name.endswith(suffix):
+                break
+        else:
+            return name
+        name = name[: -len(suffix)]
+        position = candidate + 1
+
+
+def normalize_name(name):
+    """Normalize one string: filter characters, strip company suffixes, collapse whitespace."""
+    return " ".join(strip_suffixes(_filter_chars(name)).split())
+
+
+_normalize_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(normalize_name)
+
+
+def preprocess_name(name):
+    """Remove common company suffixes, punctuation, and non-alphanumeric chars for better matching."""
+    if not isinstance(name, str):
+        return name
+    return _normalize_cached(name)
+
+
+def normalize_prefix(text):
+    """
+    Partially typed name in the form of the preprocessed titles, for prefix lookups.
+
+    Characters are filtered and spaces collapsed like normalize_name, but company
+    suffixes are kept (the user may still be typing them), and so is one trailing
+    space so that "apple " no longer matches "applebees".
+    """
+    prefix = " ".join(_filter_chars(text).split())
+    if prefix and text[-1:].isspace():
+        prefix += " "
+    return prefix
+
+
+def normalize_many(values):
+    """
+    Normalize a whole column (list, array or Series values) at once.
+
+    The character filter runs once over all distinct strings joined together, and
+    non-string values (NaN) are passed through unchanged, as preprocess_name does.
+    """
+    values = list(values)
+    distinct = list(dict.fromkeys(v for v in values if isinstance(v, str)))
+    if not distinct:
+        return values
+    joined = "\n".join(distinct)
+    if joined.count("\n") == len(distinct) - 1:
+        filtered = joined.lower().encode("ascii", "ignore").translate(None, _DELETE_BYTES_KEEP_NEWLINE)
+        stripped = "\n".join([strip_suffixes(v) for v in filtered.decode("ascii").split("\n")])
+        # collapse whitespace for the whole column at once; spaces are the only whitespace left
+        stripped = _LINE_EDGE_SPACES.sub("\n", _SPACE_RUNS.sub(" ", stripped)).strip(" ")
+        normalized = stripped.split("\n")
+    else:
+        # some value contains a newline itself, so the joined form cannot be split back
+        normalized = [normalize_name(v) for v in distinct]
+    lookup = dict(zip(distinct, normalized))
+    return [lookup[v] if isinstance(v, str) else v for v in values]
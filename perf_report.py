@@ -0,0 +1,41 @@
+"""Latency percentiles and baseline comparison shared by evaluate_model.py and the load test in test_api.py."""
+
+import math
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(1, math.ceil(pct / 100 * len(sorted_values))) - 1]
+
+
+def latency_percentiles(sorted_ms):
+    """p50/p95/p99 of already sorted latencies in milliseconds, rounded to microseconds."""
+    return {f"p{pct}": round(percentile(sorted_ms, pct), 3) for pct in (50, 95, 99)}
+
+
+def find_regressions(report, baseline, max_slowdown, rate, unit, must_not_drop=()):
+    """
+    Human-readable reasons report is worse than baseline (empty when it is not).
+
+    Both map a name (dataset or endpoint) to its stats. Throughput (the rate key,
+    printed in unit) and p50/p95/p99 latency may be worse by max_slowdown; the
+    fractions named in must_not_drop may not drop at all. Names missing from the
+    baseline are not compared.
+    """
+    problems = []
+    for name, stats in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in must_not_drop:
+            if stats[metric] < previous[metric]:
+                problems.append(f"{name}: {metric} dropped from {previous[metric]:.2%} to {stats[metric]:.2%}")
+        if stats[rate] < previous[rate] * (1 - max_slowdown):
+            problems.append(f"{name}: throughput dropped from {previous[rate]} to {stats[rate]} {unit}")
+        for pct in ("p50", "p95", "p99"):
+            before, after = previous["latency_ms"][pct], stats["latency_ms"][pct]
+            if after > before * (1 + max_slowdown):
+                problems.append(f"{name}: {pct} latency rose from {before} to {after} ms")
+    return problems
@@ -0,0 +1,61 @@
+"""Sorted string keys with binary-search prefix lookup, used for search-as-you-type suggestions."""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# sorts after every other code point, so prefix + _MAX_CHAR bounds all keys starting with prefix
+_MAX_CHAR = "\U0010ffff"
+
+
+class PrefixIndex:
+    """Keys sorted once at build time; each lookup is two binary searches plus a slice."""
+
+    def __init__(self, keys):
+        keys = list(keys)
+        # sorting row numbers by key is stable, so rows sharing a key stay in row order
+        order = sorted((row for row, key in enumerate(keys) if isinstance(key, str) and key), key=keys.__getitem__)
+        self.keys = [keys[row] for row in order]
+        self.rows = array("i", order)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def iter_prefix(self, prefix):
+        """Rows whose key starts with prefix, in key order (shorter and alphabetically earlier first)."""
+        if not prefix:
+            return iter(())
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + _MAX_CHAR, lo)
+        rows = self.rows
+        return (rows[i] for i in range(lo, hi))
+
+    def updated(self, removed, added):
+        """
+        Copy with the (key, row) pairs in removed dropped and those in added inserted.
+
+        Rows sharing a key stay in row order, as a fresh build would leave them.
+        """
+        index = PrefixIndex.__new__(PrefixIndex)
+        keys = index.keys = list(self.keys)
+        rows = index.rows = array("i", self.rows)
+        for key, row in removed:
+            if isinstance(key, str) and key:
+                position = index._position(key, row)
+                if position < len(rows) and keys[position] == key and rows[position] == row:
+                    del keys[position]
+                    del rows[position]
+        for key, row in added:
+            if isinstance(key, str) and key:
+                position = index._position(key, row)
+                keys.insert(position, key)
+                rows.insert(position, row)
+        return index
+
+    def _position(self, key, row):
+        """Where (key, row) is, or would be inserted, among the sorted keys."""
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        rows = self.rows
+        while lo < hi and rows[lo] < row:
+            lo += 1
+        return lo
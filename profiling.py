@@ -0,0 +1,176 @@
+"""
+cProfile for single requests on demand, and for a small sample of all requests.
+
+An X-Profile header (or ?profile= argument) profiles that request when
+MATCH_PROFILING=1. Its profile is saved in MATCH_PROFILE_DIR and the time spent in
+each matching stage comes back in a Server-Timing header. With
+MATCH_PROFILE_SAMPLE_RATE above 0, that share of requests is profiled as well and
+added into one profile per process, written out every MATCH_PROFILE_DUMP_SECONDS.
+"""
+
+import argparse
+import atexit
+import cProfile
+import glob
+import itertools
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+from data_utils import atomic_write
+
+# The profile flag is ignored unless this is on
+PROFILE_REQUESTS = os.environ.get("MATCH_PROFILING", "0") == "1"
+# When set, the flag has to carry this value instead of just being present
+PROFILE_TOKEN = os.environ.get("MATCH_PROFILE_TOKEN", "")
+# Share of requests profiled in the background (0 disables sampling)
+SAMPLE_RATE = float(os.environ.get("MATCH_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("MATCH_PROFILE_DIR", "profiles")
+DUMP_INTERVAL = float(os.environ.get("MATCH_PROFILE_DUMP_SECONDS", "60"))
+
+# (stage, file, function) whose cumulative time is reported for a profiled request
+BREAKDOWN = (
+    ("exact", "data_utils.py", "_exact"),
+    ("normalize", "normalize.py", "preprocess_name"),
+    ("shortlist", "ngram_index.py", "shortlist"),
+    ("bounds", "score_bounds.py", "could_reach"),
+    ("bounds", "score_bounds.py", "score_bound"),
+    ("wratio", "fuzz.py", "WRatio"),
+    ("resolve", "data_utils.py", "_resolve"),
+    ("render", "app.py", "render_match_page"),
+    ("render", "__init__.py", "jsonify"),
+)
+
+
+def breakdown(stats):
+    """Seconds spent in each BREAKDOWN stage, in BREAKDOWN order, for a pstats.Stats."""
+    stages = {}
+    for stage, _, _ in BREAKDOWN:
+        stages.setdefault(stage, 0.0)
+    for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+        for stage, stage_file, stage_function in BREAKDOWN:
+            if function == stage_function and os.path.basename(filename) == stage_file:
+                stages[stage] += cumulative
+    return stages
+
+
+def server_timing(stages, total):
+    """Server-Timing header value (milliseconds) for a breakdown and the request's total seconds."""
+    parts = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in stages.items() if seconds]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts)
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and runs cProfile around them.
+
+    Only one request is profiled at a time, because cProfile cannot run two
+    profilers at once; a request that finds the profiler busy is simply not profiled.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, enabled=PROFILE_REQUESTS, token=PROFILE_TOKEN,
+                 sample_rate=SAMPLE_RATE, dump_interval=DUMP_INTERVAL):
+        self.directory = directory
+        self.enabled = enabled
+        self.token = token
+        self.sample_rate = sample_rate
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._sampled = None
+        self._sampled_count = 0
+        self._last_dump = time.monotonic()
+        if sample_rate > 0:
+            # keep the samples gathered since the last dump when the worker exits
+            atexit.register(self.dump_samples)
+
+    def wants(self, flag):
+        """How to profile a request whose profile flag is flag: "request", "sampled" or not at all (None)."""
+        if flag and self.enabled and (not self.token or flag == self.token):
+            return "request"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def start(self):
+        """A running cProfile.Profile, or None when another request is being profiled."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as err:
+            # another profiler or a debugger already holds the hook
+            logging.warning(f"Could not start profiler: {err}")
+            self._lock.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, kind):
+        """
+        Stop profiler and save its profile.
+
+        Returns (breakdown, path) for a requested profile; sampled profiles are added
+        to this process's aggregate and None is returned.
+        """
+        profiler.disable()
+        try:
+            stats = pstats.Stats(profiler)
+            if kind == "sampled":
+                self._add_sample(stats)
+                return None
+            path = os.path.join(self.directory, f"request-{int(time.time())}-{os.getpid()}-{next(self._counter)}.prof")
+            self._write(stats, path)
+            return breakdown(stats), path
+        finally:
+            self._lock.release()
+
+    def _add_sample(self, stats):
+        if self._sampled is None:
+            self._sampled = stats
+        else:
+            self._sampled.add(stats)
+        self._sampled_count += 1
+        if time.monotonic() - self._last_dump >= self.dump_interval:
+            self.dump_samples()
+
+    def dump_samples(self):
+        """Write the aggregated sampled profile of this process, replacing the previous dump."""
+        if self._sampled is None:
+            return None
+        self._last_dump = time.monotonic()
+        path = os.path.join(self.directory, f"sampled-{os.getpid()}.prof")
+        self._write(self._sampled, path)
+        logging.info(f"Wrote sampled profile of {self._sampled_count} requests to {path}")
+        return path
+
+    def _write(self, stats, path):
+        os.makedirs(self.directory, exist_ok=True)
+        # the same format pstats.Stats.dump_stats writes, but replaced atomically
+        atomic_write(path, lambda f: marshal.dump(stats.stats, f), mode="wb")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge saved profiles and print the hottest functions.")
+    parser.add_argument("paths", nargs="*", help=f"profile files (default: {PROFILE_DIR}/*.prof)")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key (cumulative, tottime, calls, ...)")
+    parser.add_argument("--limit", type=int, default=30, help="number of functions to print")
+    args = parser.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(PROFILE_DIR, "*.prof")))
+    if not paths:
+        parser.error("no profiles found")
+    stats = pstats.Stats(*paths)
+    for stage, seconds in breakdown(stats).items():
+        print(f"{stage:<10} {seconds:10.4f} s")
+    stats.sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
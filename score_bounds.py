@@ -0,0 +1,134 @@
+"""
+Cheap upper bounds on fuzzywuzzy's WRatio, used to skip candidates that cannot reach the cutoff.
+
+WRatio is the max of several ratios, each 2 * matched / total length, so it is bounded
+without running any of them:
+- the characters two strings have in common (their histogram overlap) bound how many
+  can be matched, for the plain ratio and for the token sort and token set strings;
+- when one string is 1.5 to 8 times longer, only a partial_ratio of 100 scales to 90,
+  and for strings up to 100 characters that needs the shorter one to be a substring;
+- beyond 8 times longer every component is scaled down to at most 60.
+A candidate whose bound is below the cutoff can never be returned as a match, so it is
+dropped before the real scorer runs. Everything that survives is scored by WRatio
+itself, which keeps the scores and the top matches identical.
+"""
+
+from collections import Counter
+
+# rounding slack so float error in a bound never drops a candidate scoring exactly at the cutoff
+_EPSILON = 1e-9
+# for shorter strings, partial_ratio is 100 only if the shorter string appears in the longer one
+_EXACT_PARTIAL_MAX_LENGTH = 100
+
+
+class TextProfile:
+    """Lengths, distinct tokens and character histogram of a full_process'ed string."""
+
+    __slots__ = ("text", "length", "tokens", "set_length", "sorted_length", "_histogram")
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        words = text.split()
+        self.tokens = frozenset(words)
+        # lengths of the strings token_sort_ratio and token_set_ratio compare
+        self.sorted_length = sum(map(len, words)) + len(words) - 1 if words else 0
+        self.set_length = sum(map(len, self.tokens)) + len(self.tokens) - 1 if words else 0
+        self._histogram = None
+
+    @property
+    def histogram(self):
+        if self._histogram is None:
+            self._histogram = Counter(self.text)
+        return self._histogram
+
+
+def _joined_length(tokens):
+    return sum(map(len, tokens)) + len(tokens) - 1 if tokens else 0
+
+
+def _ratio_bound(length1, length2, common):
+    """Upper bound on fuzzywuzzy's (rounded) ratio of two strings sharing at most common characters."""
+    if not length1 or not length2:
+        return 0
+    return 200.0 * min(common, length1, length2) / (length1 + length2) + 0.5
+
+
+def _token_set_bound(query, choice, common):
+    """Upper bound on token_set_ratio, following the three comparisons it makes."""
+    if query.tokens == choice.tokens:
+        return 100
+    intersection = query.tokens & choice.tokens
+    best = _ratio_bound(query.set_length, choice.set_length, common)
+    if intersection:
+        # the sorted intersection is a prefix of both combined strings, so these are exact
+        section_length = _joined_length(intersection)
+        for profile in (query, choice):
+            if len(intersection) == len(profile.tokens):
+                return 100
+            best = max(best, 200.0 * section_length / (section_length + profile.set_length) + 0.5)
+    return best
+
+
+def wratio_bound(query, choice, common=None):
+    """
+    Upper bound on WRatio(query.text, choice.text, full_process=False) before it is
+    rounded to an integer, which can add up to half a point.
+
+    common caps the characters the strings share; leave it None for a bound from
+    lengths and tokens only, or pass histogram_overlap(query, choice) for a tighter one.
+    """
+    if not query.length or not choice.length:
+        return 0
+    if query.length <= choice.length:
+        shorter, longer = query, choice
+    else:
+        shorter, longer = choice, query
+    if common is None:
+        common = shorter.length
+    base = _ratio_bound(query.length, choice.length, common)
+    len_ratio = float(longer.length) / shorter.length
+    if len_ratio >= 1.5:
+        partial_scale = .6 if len_ratio > 8 else .9
+        if shorter.length > _EXACT_PARTIAL_MAX_LENGTH or shorter.text in longer.text:
+            partial = 100
+        else:
+            partial = 99
+        # partial token sort/set ratios are at most 100, scaled by .95 and the partial scale
+        return max(base, partial * partial_scale, 95 * partial_scale)
+    token_sort = _ratio_bound(query.sorted_length, choice.sorted_length, common)
+    return max(base, .95 * token_sort, .95 * _token_set_bound(query, choice, common))
+
+
+def histogram_overlap(query, choice):
+    """Number of characters the two strings have in common, counting repeats."""
+    histogram = choice.histogram
+    return sum(min(count, histogram[char]) for char, count in query.histogram.items() if char in histogram)
+
+
+def score_bound(query, choice):
+    """
+    Tightest of the bounds above on WRatio(query.text, choice.text) itself, its final
+    rounding included, so it can be compared with real scores.
+    """
+    bound = wratio_bound(query, choice)
+    shorter, longer = sorted((query.length, choice.length))
+    if shorter and float(longer) / shorter < 1.5:
+        bound = min(bound, wratio_bound(query, choice, histogram_overlap(query, choice)))
+    return bound + 0.5 + _EPSILON
+
+
+def could_reach(query, choice, cutoff):
+    """False only when WRatio(query.text, choice.text) is certain to be below cutoff.
+
+    Tries the length and token bound first and only counts shared characters when
+    that is not enough to rule the choice out.
+    """
+    threshold = cutoff - 0.5 - _EPSILON
+    if wratio_bound(query, choice) < threshold:
+        return False
+    shorter, longer = sorted((query.length, choice.length))
+    if float(longer) / shorter >= 1.5:
+        # the partial_ratio term dominates there, and shared characters do not lower it
+        return True
+    return wratio_bound(query, choice, histogram_overlap(query, choice)) >= threshold
@@ -0,0 +1,189 @@
+"""
+Versioned binary snapshot of a MatchIndex for fast worker startup.
+
+Layout: an 8-byte magic, a little-endian uint32 header length, a JSON header, then
+8-byte aligned sections. String columns are single UTF-8 blobs joined with NUL, so
+loading one is a single decode and split. Integer arrays (n-gram postings and
+counts) are int32 and are used straight out of the memory map without copying.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import data_utils
+from ngram_index import NgramIndex
+
+MAGIC = b"FZSNAP\x00\x01"
+FORMAT_VERSION = 2
+STRING_COLUMNS = ("titles", "tickers", "preprocessed_titles", "choices")
+SEPARATOR = "\x00"
+
+
+def snapshot_path(csv_path):
+    """Snapshots live next to the CSV they were built from."""
+    return os.path.splitext(csv_path)[0] + ".snapshot"
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode_strings(values):
+    """NUL-joined UTF-8 blob plus the positions of values that are not strings (NaN/None)."""
+    nulls = [i for i, value in enumerate(values) if not isinstance(value, str)]
+    text = SEPARATOR.join(value if isinstance(value, str) else "" for value in values)
+    return text.encode("utf-8"), nulls
+
+
+def write_snapshot(match_index, path, source_sha1):
+    """Serialize match_index to path (atomically), tagged with the source CSV's hash."""
+    sections = {}
+    header = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "rows": len(match_index),
+        "version": match_index.version,
+        "source_sha1": source_sha1,
+        "nulls": {},
+        "ngram_size": None,
+    }
+    for column in STRING_COLUMNS:
+        sections[column], header["nulls"][column] = _encode_strings(getattr(match_index, column))
+
+    ngram_index = match_index.ngram_index
+    if ngram_index is not None:
+        header["ngram_size"] = ngram_index.n
+        grams = list(ngram_index.postings)
+        offsets = array("i", [0])
+        ids = array("i")
+        for gram in grams:
+            ids.extend(ngram_index.postings[gram])
+            offsets.append(len(ids))
+        sections["grams"] = SEPARATOR.join(grams).encode("utf-8")
+        sections["posting_offsets"] = offsets.tobytes()
+        sections["posting_ids"] = ids.tobytes()
+        sections["gram_counts"] = array("i", ngram_index.gram_counts).tobytes()
+
+    # lay sections out after the header, each starting on an 8-byte boundary
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        layout[name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 8)
+    header["sections"] = layout
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+
+    def write(f):
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        for data in sections.values():
+            f.write(data + b"\x00" * (-len(data) % 8))
+
+    data_utils.atomic_write(path, write, mode="wb")
+    logging.info(f"Wrote snapshot of {len(match_index)} rows to {path}")
+
+
+def read_snapshot(path, source_sha1=None):
+    """
+    Load a MatchIndex from a snapshot, or return None if it is missing or stale.
+
+    A snapshot is stale when its format or byte order differs from this build's, or
+    when source_sha1 is given and does not match the CSV the snapshot was built from.
+    """
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    view = memoryview(buffer)
+    try:
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("bad magic")
+        (header_length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+        data_start = len(MAGIC) + 4 + header_length
+        header = json.loads(bytes(view[len(MAGIC) + 4:data_start]))
+    except (ValueError, struct.error) as err:
+        logging.warning(f"{path} is not a readable match index snapshot: {err}")
+        return None
+    if header.get("format") != FORMAT_VERSION or header.get("byteorder") != sys.byteorder:
+        logging.info(f"Snapshot {path} was written by a different build, ignoring it")
+        return None
+    if source_sha1 is not None and header.get("source_sha1") != source_sha1:
+        logging.info(f"Snapshot {path} is older than its CSV, ignoring it")
+        return None
+
+    def section(name):
+        start, length = header["sections"][name]
+        return view[data_start + start:data_start + start + length]
+
+    columns = {}
+    for column in STRING_COLUMNS:
+        values = str(section(column), "utf-8").split(SEPARATOR) if header["rows"] else []
+        for i in header["nulls"][column]:
+            values[i] = None if column == "tickers" else float("nan")
+        columns[column] = values
+
+    ngram_index = None
+    if header["ngram_size"] is not None:
+        grams = str(section("grams"), "utf-8").split(SEPARATOR) if header["sections"]["grams"][1] else []
+        offsets = section("posting_offsets").cast("i")
+        ids = section("posting_ids").cast("i")
+        postings = {gram: ids[offsets[i]:offsets[i + 1]] for i, gram in enumerate(grams)}
+        ngram_index = NgramIndex.from_postings(
+            postings, section("gram_counts").cast("i"), header["ngram_size"]
+        )
+
+    return data_utils.MatchIndex(
+        columns["titles"],
+        columns["tickers"],
+        columns["preprocessed_titles"],
+        blocking=ngram_index is not None,
+        version=header["version"],
+        choices=columns["choices"],
+        ngram_index=ngram_index,
+    )
+
+
+def build_snapshot(csv_path, match_index=None):
+    """Write the snapshot for csv_path, building the index from the CSV if none is given."""
+    if match_index is None:
+        match_index = data_utils.load_match_index(csv_path)
+    write_snapshot(match_index, snapshot_path(csv_path), file_sha1(csv_path))
+    return match_index
+
+
+def ensure_snapshot(csv_path):
+    """Rebuild the snapshot for csv_path if it is missing or stale; returns True if it was rebuilt."""
+    if read_snapshot(snapshot_path(csv_path), file_sha1(csv_path)) is not None:
+        return False
+    build_snapshot(csv_path)
+    return True
+
+
+def load_match_index(csv_path, write_missing=True):
+    """MatchIndex for csv_path from its snapshot, falling back to parsing the CSV when missing or stale."""
+    match_index = read_snapshot(snapshot_path(csv_path), file_sha1(csv_path))
+    if match_index is not None:
+        return match_index
+    match_index = data_utils.load_match_index(csv_path)
+    if write_missing:
+        try:
+            build_snapshot(csv_path, match_index)
+        except OSError as err:
+            logging.warning(f"Could not write snapshot for {csv_path}: {err}")
+    return match_index
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    build_snapshot(sys.argv[1] if len(sys.argv) > 1 else "supplemental_data/company_tickers.csv")
@@ -1,55 +1,260 @@
+"""
+Load test and latency regression check for the API.
+
+Replays company names from supplemental_data against /match, /api/match, /match/batch,
+/tickers/lookup and /suggest at a configurable concurrency, in process through
+Flask's test client (default) or against a running server (--url). Reports
+throughput and p50/p95/p99 latency per endpoint, and exits non-zero on errors or
+when an endpoint is slower than the stored baseline by more than --max-slowdown.
+
+    python3 test_api.py                      # run and compare with load_test_baseline.json
+    python3 test_api.py --save-baseline      # record the current numbers as the baseline
+    python3 test_api.py --no-baseline        # only check for errors when no baseline is stored
+    python3 test_api.py --url http://127.0.0.1:8080 --concurrency 32
+"""
+
+import argparse
+import copy
+import csv
+import glob
+import json
 import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import perf_report
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-import requests
-import time
-import pandas as pd
-
-
-def test_company_matcher():
-    """Test the company matcher API"""
-    logging.info("Starting tests...")
-    base_url = "http://127.0.0.1:8080"
-
-    try:
-        # Test 1: Home page loads
-        logging.info("\nTest 1: Testing home page load...")
-        response = requests.get(base_url)
-        if response.status_code != 200:
-            raise Exception(f"Home page failed to load: {response.status_code}")
-        if "Company Matcher" not in response.text:
-            raise Exception("Home page title not found")
-        logging.info("✓ Home page loads correctly")
-
-        # Test 2: Valid company name
-        logging.info("\nTest 2: Testing valid company name...")
-        start = time.time()
-        response = requests.post(base_url, data={"name": "Target Corporation"})
-        end = time.time()
-        logging.info(f"API Latency: {end - start:.4f} seconds")
-        if response.status_code != 200:
-            raise Exception(f"API request failed: {response.status_code}")
-        if "Target" not in response.text:
-            raise Exception("Company match not found")
-        if "Ticker Match Score" not in response.text:
-            raise Exception("Ticker match score not found")
-        logging.info("✓ Valid company name test passed")
-
-        # Test 3: Invalid input
-        logging.info("\nTest 3: Testing invalid input...")
-        response = requests.post(base_url, data={"name": "!@#$%^"})
-        if response.status_code != 200:
-            raise Exception(f"API request failed: {response.status_code}")
-        if "Company Match Score" not in response.text:
-            raise Exception("Score not found for invalid input")
-        logging.info("✓ Invalid input test passed")
-
-        logging.info("\nAll tests passed! ")
-
-    except Exception as e:
-        logging.error(f"\n❌ Test failed: {str(e)}")
+NAMES_GLOB = "supplemental_data/*.csv"
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+BASELINE_PATH = "load_test_baseline.json"
+BATCH_SIZE = 50
+SCENARIOS = ("match", "api_match", "match_batch", "tickers_lookup", "suggest")
+
+
+class InProcessClient:
+    """Sends requests through Flask's test client; one per thread."""
+
+    def __init__(self):
+        import app
+        self.client = app.app.test_client()
+
+    def send(self, method, path, data=None, json=None, params=None):
+        response = self.client.open(path, method=method, data=data, json=json, query_string=params)
+        return response.status_code
+
+
+class HttpClient:
+    """Sends requests to a running server; one session per thread."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def send(self, method, path, data=None, json=None, params=None):
+        response = self.session.request(method, self.base_url + path, data=data, json=json, params=params)
+        return response.status_code
+
+
+def load_names():
+    """input_name values from every supplemental test set, in file order."""
+    names = []
+    for path in sorted(glob.glob(NAMES_GLOB)):
+        if path == TICKERS_DATA_PATH:
+            continue
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            names.extend(row["input_name"] for row in csv.DictReader(f) if row.get("input_name"))
+    return names
+
+
+def load_tickers():
+    with open(TICKERS_DATA_PATH, newline="", encoding="utf-8-sig") as f:
+        return [row["ticker"] for row in csv.DictReader(f) if row.get("ticker")]
+
+
+def build_scenarios(names, tickers, count):
+    """Endpoint name -> list of (method, path, request kwargs), count requests each."""
+    def cycle(values, i, size=1):
+        return [values[(i * size + j) % len(values)] for j in range(size)]
+
+    return {
+        "match": [("POST", "/match", {"data": {"name": cycle(names, i)[0]}}) for i in range(count)],
+        "api_match": [("GET", "/api/match", {"params": {"name": cycle(names, i)[0]}}) for i in range(count)],
+        "match_batch": [
+            ("POST", "/match/batch", {"json": cycle(names, i, BATCH_SIZE)}) for i in range(max(1, count // 10))
+        ],
+        "tickers_lookup": [
+            ("POST", "/tickers/lookup", {"json": cycle(tickers, i, BATCH_SIZE)}) for i in range(count)
+        ],
+        # what a user has typed after a few keystrokes
+        "suggest": [
+            ("GET", "/suggest", {"params": {"q": cycle(names, i)[0][:1 + i % 6]}}) for i in range(count)
+        ],
+    }
+
+
+def run_scenario(make_client, requests_to_send, concurrency):
+    """Send requests from concurrency threads; returns throughput, latency percentiles and errors."""
+    local = threading.local()
+
+    def send(request):
+        if not hasattr(local, "client"):
+            local.client = make_client()
+        method, path, kwargs = request
+        start = time.perf_counter()
+        try:
+            status = local.client.send(method, path, **kwargs)
+        except Exception as e:
+            logging.error(f"{method} {path} failed: {e}")
+            status = None
+        return time.perf_counter() - start, status
+
+    # warm up first so client set-up (and loading the app in process) is not timed
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, requests_to_send[:concurrency]))
+        start = time.perf_counter()
+        results = list(executor.map(send, requests_to_send))
+        seconds = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status != 200),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(results) / seconds, 1) if seconds else 0,
+        "latency_ms": perf_report.latency_percentiles(latencies),
+    }
+
+
+def run_load_test(make_client, count=500, concurrency=8, scenarios=None, in_process=True):
+    """Results per endpoint for the chosen scenarios (default all)."""
+    all_scenarios = build_scenarios(load_names(), load_tickers(), count)
+    report = {}
+    for name in scenarios or all_scenarios:
+        if in_process:
+            # measure the matcher, not answers left in the result cache by the previous scenario
+            import data_utils
+            data_utils.RESULT_CACHE.clear()
+        report[name] = run_scenario(make_client, all_scenarios[name], concurrency)
+        stats = report[name]
+        latency = stats["latency_ms"]
+        logging.info(
+            f"{name:<15} {stats['requests']:>6} requests  {stats['requests_per_second']:>9} req/s  "
+            f"p50/p95/p99 {latency['p50']}/{latency['p95']}/{latency['p99']} ms  errors {stats['errors']}"
+        )
+    return report
+
+
+def find_regressions(report, baseline, max_slowdown):
+    """Human-readable reasons report is worse than baseline (empty when it is not); any failed request counts."""
+    problems = [
+        f"{name}: {stats['errors']} of {stats['requests']} requests failed"
+        for name, stats in report.items()
+        if stats["errors"]
+    ]
+    return problems + perf_report.find_regressions(report, baseline, max_slowdown, "requests_per_second", "req/s")
+
+
+def test_endpoints_under_load():
+    """Smoke run for pytest: every endpoint answers concurrent requests without errors."""
+    report = run_load_test(InProcessClient, count=40, concurrency=4)
+    assert find_regressions(report, {}, 0) == []
+
+
+def test_api_match_revalidates_with_etag(monkeypatch):
+    """GET /api/match answers 304 to a current ETag, and a new dataset version changes the ETag."""
+    import app
+    client = app.app.test_client()
+    response = client.get("/api/match", query_string={"name": "Apple Inc"})
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert response.cache_control.public and response.cache_control.max_age == app.API_MATCH_MAX_AGE
+
+    revalidated = client.get("/api/match", query_string={"name": "Apple Inc"}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+    assert revalidated.headers["ETag"] == etag
+
+    refreshed = copy.copy(app.dataset.index)
+    refreshed.version = "0" * len(refreshed.version)
+    monkeypatch.setattr(app.dataset, "index", refreshed)
+    response = client.get("/api/match", query_string={"name": "Apple Inc"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] not in (None, etag)
+
+
+def test_api_match_partial_results_are_not_cached():
+    """A result cut short by deadline_ms is sent with no-store and without an ETag."""
+    import app
+    import data_utils
+    data_utils.RESULT_CACHE.clear()
+    client = app.app.test_client()
+    response = client.get("/api/match", query_string={"name": "Appel Incorporated Holdings", "deadline_ms": "0.001"})
+    assert response.status_code == 200
+    assert response.get_json()["partial"] is True
+    assert response.cache_control.no_store
+    assert "ETag" not in response.headers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the API and check for latency regressions.")
+    parser.add_argument("scenarios", nargs="*", help=f"endpoints to test: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--url", help="test a running server instead of the app in this process")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="stored results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="only check for errors when there is no baseline, instead of failing")
+    parser.add_argument("--max-slowdown", type=float, default=0.25,
+                        help="allowed fractional throughput/latency regression against the baseline")
+    parser.add_argument("-o", "--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(unknown)}")
+
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        make_client = InProcessClient
+    report = run_load_test(make_client, args.requests, args.concurrency, args.scenarios or None, not args.url)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        logging.info(f"Saved baseline to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif args.no_baseline:
+        logging.warning(f"No baseline at {args.baseline}; only checking for errors")
+    else:
+        logging.error(
+            f"No baseline at {args.baseline}; record one with --save-baseline, or pass --no-baseline to only check for errors"
+        )
+        return 1
+    problems = find_regressions(report, baseline, args.max_slowdown)
+    for problem in problems:
+        logging.error(f"Regression: {problem}")
+    if problems:
+        return 1
+    logging.info("No regressions")
+    return 0
 
 
 if __name__ == "__main__":
-    test_company_matcher()
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Checks that NgramIndex.shortlist, which skips most of the common n-grams, keeps exactly the ids its rule allows."""
+
+import random
+
+import pytest
+
+import data_utils
+from ngram_index import NgramIndex, ngrams
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+SETTINGS = [(1, 0.5), (2, 0.3), (1, 0.8), (0, 0.0), (3, 1.0)]
+
+
+@pytest.fixture(scope="module")
+def names():
+    return list(data_utils.load_match_index(TICKERS_DATA_PATH).names)
+
+
+def brute_force_shortlist(gram_sets, query, min_shared, min_overlap):
+    query_grams = ngrams(query)
+    ids = []
+    for i, grams in enumerate(gram_sets):
+        count = len(grams & query_grams)
+        if not grams or (count and count >= min_shared and count >= min_overlap * min(len(grams), len(query_grams))):
+            ids.append(i)
+    return ids
+
+
+def queries(names, count, seed=0):
+    """Dataset names, some cut short or joined to another name, plus the short ones the rarest-first stop skips."""
+    rng = random.Random(seed)
+    picked = ["ati", "nov", "inc", "american", "first national bank holdings inc"]
+    for _ in range(count):
+        words = rng.choice(names).split()
+        if rng.random() < 0.3:
+            words = words[:rng.randint(1, len(words))]
+        elif rng.random() < 0.3:
+            words += rng.choice(names).split()
+        picked.append(" ".join(words))
+    return picked
+
+
+@pytest.mark.parametrize("min_shared, min_overlap", SETTINGS)
+def test_shortlist_matches_brute_force(names, min_shared, min_overlap):
+    index = NgramIndex(names)
+    gram_sets = [ngrams(text) for text in names]
+    for query in queries(names, 40):
+        assert index.shortlist(query, min_shared, min_overlap) == brute_force_shortlist(
+            gram_sets, query, min_shared, min_overlap
+        ), query
+
+
+def test_shortlist_matches_brute_force_after_updates(names):
+    rng = random.Random(1)
+    index = NgramIndex(names)
+    index.prepare(1, 0.5)
+    strings = list(names)
+    for _ in range(3):
+        removed = {i: strings[i] for i in rng.sample(range(len(strings)), 50) if strings[i]}
+        added = {len(strings) + k: f"{rng.choice(names)} {rng.choice(['ab', 'holdings', 'x'])}" for k in range(50)}
+        index = index.updated(removed, added)
+        for i in removed:
+            strings[i] = None
+        strings.extend(added[i] for i in sorted(added))
+    live = [text for text in strings if text is not None]
+    gram_sets = [ngrams(text) for text in strings]
+    for query in queries(live, 30, seed=2):
+        expected = [i for i in brute_force_shortlist(gram_sets, query, 1, 0.5) if strings[i] is not None]
+        assert index.shortlist(query) == expected, query
@@ -0,0 +1,111 @@
+"""Checks the WRatio bounds in score_bounds.py, and the scoring that relies on them, against real WRatio on the tickers data."""
+
+import csv
+import glob
+import math
+import random
+import time
+
+import pytest
+from fuzzywuzzy import fuzz, utils
+
+import data_utils
+from normalize import normalize_many
+from score_bounds import TextProfile, could_reach, score_bound
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+NAMES_GLOB = "supplemental_data/*.csv"
+
+
+@pytest.fixture(scope="module")
+def match_index():
+    index = data_utils.load_match_index(TICKERS_DATA_PATH)
+    # compare the scorers themselves, not answers cached by earlier tests
+    index.cache = None
+    return index
+
+
+def perturbed_queries(names, count, seed=0):
+    """Dataset names, about half with one word swapped for a word from another name."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(names).split()
+        if len(words) > 1 and rng.random() < 0.5:
+            words[rng.randrange(len(words))] = rng.choice(rng.choice(names).split())
+        queries.append(utils.full_process(" ".join(words), force_ascii=True))
+    return queries
+
+
+def test_score_bound_is_above_wratio(match_index):
+    names = [name for name in match_index.names if name]
+    rng = random.Random(1)
+    pairs = [("bolt biotherapeutics", "sab biotherapeutics inc")]
+    for query in perturbed_queries(names, 200):
+        pairs.extend((query, rng.choice(names)) for _ in range(20))
+    for query, choice in pairs:
+        score = fuzz.WRatio(query, choice, full_process=False)
+        assert score_bound(TextProfile(query), TextProfile(choice)) >= score, (query, choice)
+
+
+@pytest.mark.parametrize("limit, cutoff", [(10, 90), (10, 0), (1, 90)])
+def test_anytime_scoring_matches_full_scoring(match_index, limit, cutoff):
+    names = [name for name in match_index.names if name]
+    # these two once lost a tied match on an earlier row to the early stop
+    queries = ["leverage shares lng long tsla daily etf", "brown disney company"]
+    queries += perturbed_queries(names, 60)
+    for query in queries:
+        candidates = match_index.ngram_index.shortlist(
+            query, match_index.min_shared_ngrams, match_index.min_ngram_overlap
+        ) or range(len(match_index.names))
+        expected = match_index._score(query, candidates, limit, cutoff)
+        assert match_index._score_within(query, candidates, limit, cutoff, math.inf) == (expected, True), query
+
+
+def test_deadline_bounds_batch_latency(match_index):
+    # built once per dataset load in the app, not on the request path
+    match_index.prepare()
+    names = [name for name in match_index.names if name]
+    batch = [f"{query} holdings" for query in perturbed_queries(names, 600, seed=3)]
+    budget = 0.05
+    start = time.monotonic()
+    results, complete = match_index.match_many_within(batch, start + budget)
+    elapsed = time.monotonic() - start
+    # without a deadline this batch takes several times the budget
+    assert not all(complete)
+    assert elapsed < budget + 0.05, elapsed
+    for result, done in zip(results, complete):
+        if not done:
+            assert result[5] == data_utils.PARTIAL_MESSAGE
+
+
+def test_could_reach_never_rules_out_a_match(match_index):
+    names = [name for name in match_index.names if name]
+    for query in perturbed_queries(names, 150, seed=2):
+        query_profile = TextProfile(query)
+        # the shortlist holds the similar names, where scores come close to the cutoffs
+        candidates = match_index.ngram_index.shortlist(
+            query, match_index.min_shared_ngrams, match_index.min_ngram_overlap
+        ) or range(len(match_index.names))
+        for i in candidates:
+            choice = match_index.names[i]
+            score = fuzz.WRatio(query, choice, full_process=False)
+            for cutoff in (50, 80, 90, 95, 100):
+                if score >= cutoff:
+                    assert could_reach(query_profile, TextProfile(choice), cutoff), (query, choice, cutoff)
+
+
+def test_pruning_does_not_change_matches():
+    titles, tickers = data_utils.read_tickers_csv(TICKERS_DATA_PATH)
+    preprocessed = normalize_many(titles)
+    pruned = data_utils.MatchIndex(titles, tickers, preprocessed, cache=None, prune=True)
+    unpruned = data_utils.MatchIndex(titles, tickers, preprocessed, cache=None, prune=False)
+    inputs = []
+    for path in sorted(glob.glob(NAMES_GLOB)):
+        if path == TICKERS_DATA_PATH:
+            continue
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            inputs.extend(row["input_name"] for row in csv.DictReader(f) if row.get("input_name"))
+    assert inputs
+    for name in inputs:
+        assert pruned.match(name) == unpruned.match(name), name
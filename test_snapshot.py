@@ -0,0 +1,78 @@
+"""Round-trips MatchIndex through snapshot.py and checks it comes back the same as one built from the CSV."""
+
+import pytest
+
+import data_utils
+import snapshot
+
+TICKERS_DATA_PATH = "supplemental_data/company_tickers.csv"
+# a listing without a ticker and one without a title, the gaps real feeds have
+FIXTURE_CSV = (
+    "ticker,title\n"
+    "AAPL,Apple Inc. - Common Stock\n"
+    ",Nano Labs Ltd - Class A Ordinary Shares\n"
+    "XYZ,\n"
+    "MSFT,Microsoft Corporation - Common Stock\n"
+    "APLE,Apple Hospitality REIT Inc. Common Shares\n"
+)
+QUERIES = ["Apple", "Apple Inc", "Nano Labs", "Microsoft Corp", "Apple Hospitality", "XYZ", "Nothing Alike", ""]
+
+
+def same_values(a, b):
+    # missing titles are NaN, which never equals itself
+    return [repr(value) for value in a] == [repr(value) for value in b]
+
+
+def postings(match_index):
+    return {gram: list(ids) for gram, ids in match_index.ngram_index.postings.items()}
+
+
+def round_trip(csv_path, tmp_path):
+    built = data_utils.load_match_index(str(csv_path))
+    path = tmp_path / "index.snapshot"
+    snapshot.write_snapshot(built, str(path), snapshot.file_sha1(str(csv_path)))
+    loaded = snapshot.read_snapshot(str(path), snapshot.file_sha1(str(csv_path)))
+    assert loaded is not None
+    # the two share a version, so a shared result cache would answer for both
+    built.cache = loaded.cache = None
+    return built, loaded
+
+
+@pytest.mark.parametrize("source", ["fixture", "tickers"])
+def test_round_trip_matches_index_built_from_csv(source, tmp_path):
+    if source == "fixture":
+        csv_path = tmp_path / "company_tickers.csv"
+        csv_path.write_text(FIXTURE_CSV)
+    else:
+        csv_path = TICKERS_DATA_PATH
+    built, loaded = round_trip(csv_path, tmp_path)
+
+    assert loaded.version == built.version
+    assert len(loaded) == len(built)
+    for column in snapshot.STRING_COLUMNS:
+        assert same_values(getattr(loaded, column), getattr(built, column)), column
+    if source == "fixture":
+        assert None in loaded.tickers
+        assert any(not isinstance(title, str) for title in loaded.titles)
+    assert loaded.ngram_index.n == built.ngram_index.n
+    assert postings(loaded) == postings(built)
+    assert list(loaded.ngram_index.gram_counts) == list(built.ngram_index.gram_counts)
+    assert loaded.ngram_index.gramless_ids == built.ngram_index.gramless_ids
+    queries = QUERIES
+    if source == "tickers":
+        # raw titles take the exact path, preprocessed ones the fuzzy one
+        queries = QUERIES + list(built.titles[::500]) + list(built.preprocessed_titles[250::500])
+    for name in queries:
+        assert repr(loaded.match(name)) == repr(built.match(name)), name
+
+
+def test_stale_snapshots_are_ignored(tmp_path, monkeypatch):
+    csv_path = tmp_path / "company_tickers.csv"
+    csv_path.write_text(FIXTURE_CSV)
+    path = str(tmp_path / "index.snapshot")
+    snapshot.write_snapshot(data_utils.load_match_index(str(csv_path)), path, "0" * 40)
+
+    assert snapshot.read_snapshot(path, "0" * 40) is not None
+    assert snapshot.read_snapshot(path, snapshot.file_sha1(str(csv_path))) is None
+    monkeypatch.setattr(snapshot, "FORMAT_VERSION", snapshot.FORMAT_VERSION + 1)
+    assert snapshot.read_snapshot(path, "0" * 40) is None
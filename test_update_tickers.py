@@ -0,0 +1,168 @@
+"""Tests update_tickers.py against a local HTTP server standing in for nasdaqtrader.com."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import data_utils
+import dataset_delta
+import snapshot
+import update_tickers
+
+NASDAQ_FIXTURE = (
+    "Symbol|Security Name|Market Category|Test Issue|Financial Status|Round Lot Size|ETF|NextShares\n"
+    "AAPL|Apple Inc. - Common Stock|Q|N|N|100|N|N\n"
+    # pandas reads this symbol as missing, so the row has no ticker
+    "NA|Nano Labs Ltd - Class A Ordinary Shares|G|N|N|100|N|N\n"
+    "AACB|Artius II Acquisition Inc. - Class A Ordinary Shares|G|N|N|100|N|N\n"
+    "File Creation Time: 0711202521:32|||||||\n"
+)
+OTHER_FIXTURE = (
+    "ACT Symbol|Security Name|Exchange|CQS Symbol|ETF|Round Lot Size|Test Issue|NASDAQ Symbol\n"
+    "TGT|Target Corporation Common Stock|N|TGT|N|100|N|TGT\n"
+    "AAPL|Duplicate Apple Listing|N|AAPL|N|100|N|AAPL\n"
+    "File Creation Time: 0711202521:32|||||||\n"
+)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves the fixture feeds with ETags and answers 304 when they match."""
+
+    def do_GET(self):
+        feed = self.server.feeds.get(self.path)
+        if feed is None:
+            self.send_error(404)
+            return
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        etag = f'"{hash(feed) & 0xffffffff:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = feed.encode("latin-1")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def feed_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    server.feeds = {"/nasdaqlisted.txt": NASDAQ_FIXTURE, "/otherlisted.txt": OTHER_FIXTURE}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def feeds_for(server):
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    return [
+        (base + "/nasdaqlisted.txt", "Symbol", "Security Name"),
+        (base + "/otherlisted.txt", "ACT Symbol", "Security Name"),
+    ]
+
+
+def test_downloads_and_merges_feeds(feed_server, tmp_path):
+    output = tmp_path / "company_tickers.csv"
+    assert update_tickers.main(feeds_for(feed_server), str(output)) is True
+    df = pd.read_csv(output, keep_default_na=False)
+    assert df.columns.tolist() == ["ticker", "title"]
+    assert df["ticker"].tolist() == ["AAPL", "", "AACB", "TGT"]
+    assert df.loc[df["ticker"] == "AAPL", "title"].item() == "Apple Inc. - Common Stock"
+    assert (tmp_path / "company_tickers.validators.json").exists()
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith(".tmp-")]
+
+
+def test_unchanged_feeds_are_not_rewritten(feed_server, tmp_path):
+    output = tmp_path / "company_tickers.csv"
+    update_tickers.main(feeds_for(feed_server), str(output))
+    mtime = output.stat().st_mtime_ns
+    feed_server.requests.clear()
+    assert update_tickers.main(feeds_for(feed_server), str(output)) is False
+    assert output.stat().st_mtime_ns == mtime
+    assert all(etag for _, etag in feed_server.requests)
+
+
+def test_one_changed_feed_rebuilds_from_both(feed_server, tmp_path):
+    output = tmp_path / "company_tickers.csv"
+    update_tickers.main(feeds_for(feed_server), str(output))
+    feed_server.feeds["/otherlisted.txt"] = OTHER_FIXTURE.replace(
+        "TGT|Target", "XYZ|Xyz Holdings Common Stock|N|XYZ|N|100|N|XYZ\nTGT|Target"
+    )
+    assert update_tickers.main(feeds_for(feed_server), str(output)) is True
+    # listed rows keep their places, the one without a ticker too, and new ones are appended
+    assert pd.read_csv(output, keep_default_na=False)["ticker"].tolist() == ["AAPL", "", "AACB", "TGT", "XYZ"]
+    delta = dataset_delta.read_delta(str(output))
+    assert delta["added"] == [["XYZ", "Xyz Holdings Common Stock"]]
+    assert delta["removed"] == [] and delta["renamed"] == []
+    assert delta["sha1"] == snapshot.file_sha1(str(output))
+
+
+def test_delta_is_written_before_the_csv(feed_server, tmp_path, monkeypatch):
+    output = tmp_path / "company_tickers.csv"
+    update_tickers.main(feeds_for(feed_server), str(output))
+    feed_server.feeds["/otherlisted.txt"] = OTHER_FIXTURE.replace(
+        "TGT|Target", "XYZ|Xyz Holdings Common Stock|N|XYZ|N|100|N|XYZ\nTGT|Target"
+    )
+    deltas_seen = []
+
+    def recording_write(path, write, mode="w"):
+        if path == str(output):
+            deltas_seen.append(dataset_delta.read_delta(path))
+        data_utils.atomic_write(path, write, mode)
+
+    monkeypatch.setattr(update_tickers, "atomic_write", recording_write)
+    assert update_tickers.main(feeds_for(feed_server), str(output)) is True
+    # a server that notices the new CSV must already find the delta leading to it
+    assert deltas_seen[0]["sha1"] == snapshot.file_sha1(str(output))
+
+
+def test_delta_matches_full_rebuild(feed_server, tmp_path):
+    output = tmp_path / "company_tickers.csv"
+    update_tickers.main(feeds_for(feed_server), str(output))
+    before = data_utils.load_match_index(str(output))
+    feed_server.feeds["/nasdaqlisted.txt"] = NASDAQ_FIXTURE.replace(
+        "AACB|Artius II Acquisition Inc. - Class A Ordinary Shares", "AACB|Artius Acquisition Corp - Units"
+    )
+    feed_server.feeds["/otherlisted.txt"] = OTHER_FIXTURE.replace(
+        "TGT|Target Corporation Common Stock|N|TGT", "XYZ|Xyz Holdings Common Stock|N|XYZ"
+    )
+    assert update_tickers.main(feeds_for(feed_server), str(output)) is True
+    delta = dataset_delta.read_delta(str(output))
+    assert delta["removed"] == [["TGT", "Target Corporation Common Stock"]]
+    assert delta["renamed"] == [["AACB", "Artius Acquisition Corp - Units"]]
+    assert delta["added"] == [["XYZ", "Xyz Holdings Common Stock"]]
+
+    patched = before.apply_delta(delta)
+    rebuilt = data_utils.load_match_index(str(output))
+    # same version, so a shared result cache would answer for both
+    patched.cache = rebuilt.cache = None
+    assert patched.version == rebuilt.version
+    assert len(patched) == len(rebuilt) == 4
+    for name in ["Apple Inc.", "Nano Labs", "Artius Acquisition", "Artius II Acquisition", "Target", "Xyz Holdings", "TGT"]:
+        assert patched.match(name) == rebuilt.match(name)
+    assert patched.suggest("a") == rebuilt.suggest("a")
+    # requests still holding the old index keep seeing the old data
+    assert before.match("Target Corporation Common Stock")[1] == "TGT"
+
+
+def test_full_update_writes_feed_order_without_delta(feed_server, tmp_path):
+    output = tmp_path / "company_tickers.csv"
+    update_tickers.main(feeds_for(feed_server), str(output))
+    feed_server.feeds["/otherlisted.txt"] = OTHER_FIXTURE.replace(
+        "TGT|Target", "XYZ|Xyz Holdings Common Stock|N|XYZ|N|100|N|XYZ\nTGT|Target"
+    )
+    assert update_tickers.main(feeds_for(feed_server), str(output), force=True) is True
+    assert pd.read_csv(output, keep_default_na=False)["ticker"].tolist() == ["AAPL", "", "AACB", "XYZ", "TGT"]
+    assert dataset_delta.read_delta(str(output)) is None
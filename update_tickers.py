@@ -1,52 +1,168 @@
 import logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import requests
-import os
+
+import data_utils
+import dataset_delta
+import snapshot
+from data_utils import atomic_write
 
 # URL for NASDAQ listed companies
-NASDAQ_URL = "https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt"
-OTHER_URL = "https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt"
+NASDAQ_URL = os.environ.get("NASDAQ_URL", "https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt")
+OTHER_URL = os.environ.get("OTHER_URL", "https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt")
 OUTPUT_DIR = "supplemental_data"
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "company_tickers.csv")
+REQUEST_TIMEOUT = 60
+
+# (url, symbol column, name column) for each feed
+FEEDS = [
+    (NASDAQ_URL, "Symbol", "Security Name"),
+    (OTHER_URL, "ACT Symbol", "Security Name"),
+]
 
-# Ensure output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+def validators_path(output_file):
+    """ETag/Last-Modified validators are kept next to the output CSV."""
+    return os.path.splitext(output_file)[0] + ".validators.json"
 
-def download_and_clean(url, symbol_col, name_col):
+
+def load_validators(output_file):
+    try:
+        with open(validators_path(output_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def download_and_clean(url, symbol_col, name_col, validators=None):
+    """
+    Download one symbol directory feed and return (DataFrame, validators).
+
+    When validators from the last download are given the request is conditional,
+    and (None, validators) is returned if the server answers 304 Not Modified.
+    """
     logging.info(f"Downloading {url}...")
-    response = requests.get(url)
-    response.raise_for_status()
-    lines = response.text.splitlines()
-    # Remove the last line if it's not data (footer)
-    if lines[-1].startswith("File Creation Time"):  # NASDAQ puts a footer
-        lines = lines[:-1]
-    # Save to a temporary file for pandas
-    temp_file = os.path.join(OUTPUT_DIR, "temp.txt")
-    with open(temp_file, "w") as f:
-        f.write("\n".join(lines))
-    # Read with pandas
-    df = pd.read_csv(temp_file, sep="|")
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    with requests.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 304:
+            logging.info(f"{url} not modified")
+            return None, validators
+        response.raise_for_status()
+        new_validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        # parse straight from the response body instead of round-tripping through a temp file
+        response.raw.decode_content = True
+        df = pd.read_csv(response.raw, sep="|", encoding=response.encoding or "utf-8")
+    # NASDAQ puts a "File Creation Time" footer after the data
+    df = df[~df[symbol_col].astype(str).str.startswith("File Creation Time")]
     # Keep only relevant columns
     df = df[[symbol_col, name_col]]
     df.columns = ["ticker", "title"]
-    os.remove(temp_file)
-    logging.info(f"Saved {len(df)} tickers to temp file")
-    return df
+    logging.info(f"Downloaded {len(df)} tickers from {url}")
+    return df, new_validators
+
+
+def keep_row_order(combined, old_titles, old_tickers):
+    """Rows that were already listed first, in their old order, then new ones in feed order."""
+    position = {}
+    for i, key in enumerate(map(dataset_delta.row_key, old_titles, old_tickers)):
+        position.setdefault(key, i)
+    keys = map(dataset_delta.row_key, combined["title"], combined["ticker"])
+    rank = pd.Series([position.get(key, len(position)) for key in keys])
+    return combined.iloc[rank.argsort(kind="stable")].reset_index(drop=True)
+
+
+def read_previous(output_file):
+    """(titles, tickers, sha1) of the CSV about to be replaced, or None if it cannot be read."""
+    try:
+        titles, tickers = data_utils.read_tickers_csv(output_file)
+        return titles, tickers, snapshot.file_sha1(output_file)
+    except Exception as e:
+        logging.warning(f"Cannot read {output_file} to compute a delta, rewriting it in full: {e}")
+        return None
+
+
+def write_delta(output_file, previous, data):
+    """Save the delta from the previous CSV to data, the CSV about to replace it, when it can be expressed as one."""
+    if previous is None:
+        return
+    old_titles, old_tickers, base_sha1 = previous
+    titles, tickers = data_utils.parse_tickers_csv(io.StringIO(data.decode("utf-8"), newline=""))
+    delta = dataset_delta.compute_delta(old_titles, old_tickers, titles, tickers)
+    if delta is None:
+        logging.info(f"Changes to {output_file} cannot be applied as a delta; servers will reload it in full")
+        return
+    dataset_delta.write_delta(
+        output_file, delta, base_sha1, hashlib.sha1(data).hexdigest(), data_utils.dataset_version(titles, tickers)
+    )
+
+
+def main(feeds=None, output_file=OUTPUT_FILE, force=False):
+    """
+    Download all feeds concurrently and rewrite output_file only if any of them changed.
+
+    Rows already in output_file keep their order and new tickers are appended, and
+    the changes are saved as a delta next to it for running servers to apply.
+    force ignores the saved validators and the old file: the CSV is written in feed
+    order and servers rebuild from it in full.
+    """
+    feeds = feeds or FEEDS
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    have_output = os.path.exists(output_file)
+    saved = {} if force or not have_output else load_validators(output_file)
+
+    def fetch(feed, conditional=True):
+        url, symbol_col, name_col = feed
+        return download_and_clean(url, symbol_col, name_col, saved.get(url) if conditional else None)
 
+    with ThreadPoolExecutor(max_workers=len(feeds)) as pool:
+        results = list(pool.map(fetch, feeds))
+    if all(df is None for df, _ in results):
+        logging.info(f"All feeds unchanged, keeping {output_file}")
+        snapshot.ensure_snapshot(output_file)
+        return False
+    # some feed changed: the unchanged ones have to be fetched in full to rebuild the file
+    results = [
+        result if result[0] is not None else fetch(feed, conditional=False)
+        for feed, result in zip(feeds, results)
+    ]
 
-def main():
-    logging.info("Downloading NASDAQ...")
-    nasdaq_df = download_and_clean(NASDAQ_URL, "Symbol", "Security Name")
-    logging.info("Downloading NYSE/AMEX/others...")
-    other_df = download_and_clean(OTHER_URL, "ACT Symbol", "Security Name")
-    combined = pd.concat([nasdaq_df, other_df], ignore_index=True)
+    combined = pd.concat([df for df, _ in results], ignore_index=True)
     combined = combined.drop_duplicates(subset=["ticker"])
-    combined.to_csv(OUTPUT_FILE, index=False)
-    logging.info(f"Saved {len(combined)} tickers to {OUTPUT_FILE}")
+    previous = read_previous(output_file) if have_output and not force else None
+    if previous is not None:
+        combined = keep_row_order(combined, previous[0], previous[1])
+    data = combined.to_csv(index=False).encode("utf-8")
+    # an old delta must never be applied on top of the new file
+    dataset_delta.remove_delta(output_file)
+    # the delta goes first, so a server that sees the new CSV finds its delta next to it
+    write_delta(output_file, previous, data)
+    atomic_write(output_file, lambda f: f.write(data), mode="wb")
+    validators = {feed[0]: feed_validators for feed, (_, feed_validators) in zip(feeds, results)}
+    atomic_write(validators_path(output_file), lambda f: json.dump(validators, f, indent=2))
+    logging.info(f"Saved {len(combined)} tickers to {output_file}")
+    snapshot.build_snapshot(output_file)
+    return True
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Download the NASDAQ symbol directories into the tickers CSV.")
+    parser.add_argument("--full", action="store_true",
+                        help="download unconditionally and rewrite the CSV without a delta")
+    main(force=parser.parse_args().full)